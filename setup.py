@@ -22,17 +22,18 @@ version_file = join(setup_dir, 'src', 'hcl', 'version.py')
 def _pre_install():
     '''Initialize the parse table at install time'''
 
-    # Generate the parsetab.dat file at setup time
-    dat = join(setup_dir, 'src', 'hcl', 'parsetab.dat')
-    if exists(dat):
-        os.unlink(dat)
+    # Generate the _parsetab.py and parsetab.dat files at setup time
+    for fname in ('_parsetab.py', 'parsetab.dat'):
+        fname = join(setup_dir, 'src', 'hcl', fname)
+        if exists(fname):
+            os.unlink(fname)
 
     sys.path.insert(0, join(setup_dir, 'src'))
 
     import hcl
     from hcl.parser import HclParser
 
-    parser = HclParser()
+    parser = HclParser(write_tables=True, optimize=False)
 
 
 class build_py(_build_py):
@@ -1,4 +1,10 @@
-from .api import dumps, load, loads
+from .api import dumps, load, load_dir, load_many, loads, loads_many, validate
+from .lexer import HclSyntaxError
+
+import sys
+
+if sys.version_info >= (3, 6):
+    from .aio import aload, aload_many, aloads
 
 try:
     from .version import __version__
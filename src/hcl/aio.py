@@ -0,0 +1,116 @@
+'''
+    asyncio versions of the load functions. Parsing is CPU bound and would
+    block the event loop, so it's run in an executor, with the number of
+    documents being parsed at once bounded by a semaphore.
+
+    This module needs Python 3.6 or later.
+'''
+
+import asyncio
+import os
+import weakref
+
+from . import api
+
+_executor = None
+_max_concurrency = min(32, (os.cpu_count() or 1) + 4)
+
+# One semaphore per event loop, as a semaphore can only be used by the loop
+# it was created in
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def configure(executor=None, max_concurrency=None):
+    '''
+        Sets the defaults used by the functions in this module.
+
+        :param executor: concurrent.futures executor to parse in. A
+                         ThreadPoolExecutor keeps the event loop responsive,
+                         and a ProcessPoolExecutor also parses on several
+                         CPUs at once. None uses the loop's default executor
+        :param max_concurrency: maximum number of documents being parsed at
+                                once (per event loop), defaults to the number
+                                of CPUs plus 4, up to 32
+    '''
+    global _executor, _max_concurrency
+    _executor = executor
+    if max_concurrency is not None:
+        _max_concurrency = max_concurrency
+    _semaphores.clear()
+
+
+def _semaphore(loop):
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(_max_concurrency)
+    return semaphore
+
+
+async def _run(executor, fn, *args):
+    loop = asyncio.get_event_loop()
+    if executor is None:
+        executor = _executor
+
+    # If cancelled while waiting for the semaphore or for a worker, the
+    # document isn't parsed at all. A parse that has already started runs
+    # to completion in the executor, but its result is discarded.
+    async with _semaphore(loop):
+        return await loop.run_in_executor(executor, fn, *args)
+
+
+async def aload(fp, export_comments=None, executor=None):
+    '''
+        Coroutine version of hcl.load. The file is read and parsed in the
+        executor.
+
+        :param fp: The path of a file, or with a thread executor (only) an
+                   object that has a read() function
+        :param export_comments: optional string, see hcl.load
+        :param executor: executor to use instead of the one set by configure
+
+        :returns: Dictionary
+    '''
+    return await _run(executor, api.load, fp, export_comments)
+
+
+async def aloads(s, export_comments=None, executor=None):
+    '''
+        Coroutine version of hcl.loads.
+
+        :param s: string to parse
+        :param export_comments: optional string, see hcl.loads
+        :param executor: executor to use instead of the one set by configure
+
+        :returns: Dictionary
+    '''
+    return await _run(executor, api.loads, s, export_comments)
+
+
+async def aload_many(fps, export_comments=None, executor=None):
+    '''
+        Loads many files concurrently, like calling aload on each of them.
+
+        :param fps: iterable of paths (or file objects, see aload)
+        :param export_comments: optional string, see hcl.load
+        :param executor: executor to use instead of the one set by configure
+
+        :returns: Asynchronous generator of (fp, dictionary) tuples, in the
+                  order that the files finish loading. When a file can't be
+                  read or parsed, the IOError or ValueError is yielded in
+                  place of its dictionary. Closing the generator early
+                  cancels the files that haven't been loaded yet.
+    '''
+
+    async def load(fp):
+        try:
+            return fp, await aload(fp, export_comments, executor)
+        except (IOError, OSError, ValueError) as e:
+            return fp, e
+
+    tasks = [asyncio.ensure_future(load(fp)) for fp in fps]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
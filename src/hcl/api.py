@@ -1,8 +1,25 @@
+from collections import OrderedDict, namedtuple
+import codecs
+import fnmatch
+import hashlib
+import io
 import json
-from .parser import HclParser
+import marshal
+import mmap
+import os
+import re
+import stat
+import tempfile
+import threading
+from .lexer import Lexer
+from .parser import get_parser
 
 import sys
 
+# Files smaller than this are read rather than memory mapped, as mapping them
+# costs more than the copy it saves
+mmap_threshold = 1 << 20
+
 if sys.version_info[0] < 3:
 
     def u(s):
@@ -11,6 +28,18 @@ if sys.version_info[0] < 3:
         else:
             return unicode(s, 'utf-8')
 
+    path_types = (str, unicode)
+
+    json_accepts_bytes = True
+
+    def _cpu_count():
+        import multiprocessing
+
+        return multiprocessing.cpu_count()
+
+    def _read(fp):
+        return fp.read()
+
 
 else:
 
@@ -20,12 +49,71 @@ else:
         else:
             return s
 
+    path_types = (str, getattr(os, 'PathLike', str))
+
+    # json.loads only accepts bytes since Python 3.6
+    json_accepts_bytes = sys.version_info >= (3, 6)
+
+    def _cpu_count():
+        return os.cpu_count() or 1
+
+    def _read(fp):
+        '''
+            Reads the rest of a file. Large regular files opened in binary
+            mode are decoded straight from a memory map of the file, so the
+            raw bytes aren't read into memory and held alongside the decoded
+            text.
+        '''
+        # Only plain files can be mapped: for wrapped streams, such as
+        # gzip.GzipFile, fileno() isn't the data that read() returns
+        if isinstance(fp, io.BufferedReader):
+            is_file = isinstance(fp.raw, io.FileIO)
+        else:
+            is_file = isinstance(fp, io.FileIO)
+        if not is_file:
+            return fp.read()
+
+        try:
+            fileno = fp.fileno()
+            st = os.fstat(fileno)
+            start = fp.tell()
+        except (AttributeError, OSError, ValueError):
+            return fp.read()
+
+        size = st.st_size
+        if not stat.S_ISREG(st.st_mode) or start >= size:
+            return fp.read()
+
+        # Small files are cheaper to read than to map
+        if size - start < mmap_threshold:
+            return fp.read()
+
+        m = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(m)
+            try:
+                s = codecs.utf_8_decode(view[start:], 'strict', True)[0]
+            finally:
+                view.release()
+        finally:
+            m.close()
+
+        # leave the file where read() would have
+        fp.seek(size)
+        return s
+
+
+# Leading whitespace, as defined by str.isspace(). For bytes this only covers
+# ASCII, so other whitespace is left to the str pattern once decoded
+_leading_space = re.compile(r'\s*', re.UNICODE)
+_leading_space_bytes = re.compile(b'[\t\n\x0b\x0c\r\x1c-\x1f ]*')
+
 
 def isHcl(s):
     '''
         Detects whether a string is JSON or HCL
         
-        :param s: String that may contain HCL or JSON
+        :param s: String (or UTF-8 bytes) that may contain HCL or JSON
         
         :returns: True if HCL, False if JSON, raises ValueError
                   if neither
@@ -33,24 +121,28 @@ def isHcl(s):
     if not s:
         return True
 
-    for c in s:
-        if c.isspace():
-            continue
-
-        if c == '{':
-            return False
-        else:
-            return True
+    if isinstance(s, bytes):
+        i = _leading_space_bytes.match(s).end()
+        c = s[i : i + 1]
+        if c < b'\x80':
+            if not c:
+                raise ValueError("No HCL object could be decoded")
+            return c != b'{'
+        s = u(s)
 
-    raise ValueError("No HCL object could be decoded")
+    i = _leading_space.match(s).end()
+    if i == len(s):
+        raise ValueError("No HCL object could be decoded")
+    return s[i] != '{'
 
 
 def load(fp, export_comments=None):
     '''
-        Deserializes a file-pointer like object into a python dictionary.
-        The contents of the file must either be JSON or HCL.
+        Deserializes a file into a python dictionary. The contents of the
+        file must either be JSON or HCL.
         
-        :param fp: An object that has a read() function
+        :param fp: The path of a file, or an object that has a read()
+                   function. Files opened in binary mode are decoded as UTF-8
         :param export_comments: optional string that allow to export also coded comments. it could be:
             'LINE': to export only single-line comments (// or #)
             'MULTILINE': to export only multi-line comments (/* ... */)
@@ -59,7 +151,9 @@ def load(fp, export_comments=None):
         
         :returns: Dictionary
     '''
-    return loads(fp.read(), export_comments=export_comments)
+    if isinstance(fp, path_types):
+        return _load_path(fp, export_comments)
+    return loads(_read(fp), export_comments=export_comments)
 
 
 def loads(s, export_comments=None):
@@ -76,11 +170,477 @@ def loads(s, export_comments=None):
         
         :returns: Dictionary 
     '''
-    s = u(s)
+    return _loads(s, export_comments)
+
+
+def load_many(fps, export_comments=None):
+    '''
+        Deserializes many files, like calling load on each of them. The
+        files are parsed with a single lexer and parser.
+        
+        :param fps: iterable of paths or objects that have a read() function
+        :param export_comments: optional string, see load
+        
+        :returns: Generator of dictionaries, in the same order as fps. When
+                  a file can't be read or parsed, the IOError or ValueError
+                  is yielded in its place, and the rest are still loaded.
+    '''
+    lexer = Lexer(export_comments=export_comments, optimize=get_parser().optimize)
+
+    for fp in fps:
+        try:
+            if isinstance(fp, path_types):
+                yield _load_path(fp, export_comments, lexer)
+            else:
+                yield _loads(_read(fp), export_comments, lexer)
+        except (IOError, OSError, ValueError) as e:
+            yield e
+
+
+def load_dir(path, pattern='*.hcl', workers=None, export_comments=None):
+    '''
+        Deserializes all of the files in a directory tree whose names match
+        a pattern. The files are parsed in parallel by a pool of worker
+        processes, each of which builds its parser once and parses batches
+        of files with it.
+        
+        :param path: directory to search
+        :param pattern: glob pattern that file names must match
+        :param workers: number of worker processes, defaults to the number
+                        of CPUs. With 1 worker (or when concurrent.futures
+                        isn't available) the files are parsed in this process
+        :param export_comments: optional string, see load
+        
+        :returns: OrderedDict mapping the path of each file to its
+                  dictionary, sorted by path. When a file can't be read or
+                  parsed, the IOError or ValueError is stored in its place.
+        :raises OSError: if path, or a directory in it, can't be listed
+    '''
+
+    # os.walk ignores errors by default, which would make a missing
+    # directory look like one with no matching files
+    def onerror(e):
+        raise e
+
+    paths = []
+    for root, dirs, files in os.walk(path, onerror=onerror):
+        for name in fnmatch.filter(files, pattern):
+            paths.append(os.path.join(root, name))
+    paths.sort()
+
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        workers = 1
+
+    if workers is None:
+        workers = _cpu_count()
+    if workers <= 1 or len(paths) <= 1:
+        return OrderedDict(zip(paths, load_many(paths, export_comments)))
+
+    disk_cache = _disk_cache
+    if disk_cache is not None:
+        disk_cache = (disk_cache.directory, disk_cache.max_size)
+
+    # Several batches per worker, so that a batch of slow files doesn't keep
+    # one worker busy while the others are idle
+    size = max(1, min(64, len(paths) // (workers * 4)))
+    batches = [paths[i : i + size] for i in range(0, len(paths), size)]
+
+    results = {}
+    with ProcessPoolExecutor(min(workers, len(batches))) as executor:
+        futures = [
+            executor.submit(_load_batch, batch, export_comments, disk_cache)
+            for batch in batches
+        ]
+        for batch, future in zip(batches, futures):
+            results.update(zip(batch, future.result()))
+
+    return OrderedDict((p, results[p]) for p in paths)
+
+
+def _load_batch(paths, export_comments, disk_cache):
+    # Runs in the worker processes of load_dir. Processes that were started
+    # rather than forked don't have the disk cache enabled yet
+    if disk_cache is not None and _disk_cache is None:
+        enable_disk_cache(*disk_cache)
+    return list(load_many(paths, export_comments))
+
+
+def loads_many(ss, export_comments=None):
+    '''
+        Deserializes many strings, like calling loads on each of them. The
+        strings are parsed with a single lexer and parser.
+        
+        :param ss: iterable of strings to parse
+        :param export_comments: optional string, see loads
+        
+        :returns: Generator of dictionaries, in the same order as ss. When
+                  a string can't be parsed, the ValueError is yielded in its
+                  place, and the rest are still parsed.
+    '''
+    lexer = Lexer(export_comments=export_comments, optimize=get_parser().optimize)
+
+    for s in ss:
+        try:
+            yield _loads(s, export_comments, lexer)
+        except ValueError as e:
+            yield e
+
+
+def _load_path(path, export_comments, lexer=None):
+    with open(path, 'rb') as f:
+        disk_cache = _disk_cache
+        if disk_cache is None:
+            return _loads(_read(f), export_comments, lexer)
+
+        # The file is stat'ed before it's read, so if it changes while being
+        # read the entry won't match the new mtime
+        key = disk_cache.key(path, os.fstat(f.fileno()), export_comments)
+        result = disk_cache.get(key)
+        if result is _missing:
+            result = _loads(_read(f), export_comments, lexer)
+            disk_cache.put(key, result)
+        return result
+
+
+def _loads(s, export_comments, lexer=None):
+    cache = _cache
+    if cache is not None:
+        key = (s, export_comments)
+        result = cache.get(key)
+        if result is not _missing:
+            return result
+
     if isHcl(s):
-        return HclParser().parse(s, export_comments=export_comments)
+        result = get_parser().parse(u(s), export_comments=export_comments, lexer=lexer)
+    elif json_accepts_bytes:
+        result = json.loads(s)
     else:
-        return json.loads(s)
+        result = json.loads(u(s))
+
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+
+#
+# Result cache
+#
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses evictions entries size')
+
+# Returned by the caches' get() when there's no entry, as None is a valid
+# result
+_missing = object()
+
+
+class _ResultCache(object):
+    '''
+        LRU cache of parsed documents, keyed by the input and export_comments.
+        Results are stored marshalled, which makes every hit a fresh copy
+        that callers are free to modify.
+    '''
+
+    def __init__(self, max_entries, max_size):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return _missing
+            # most recently used entries are last
+            self.entries[key] = data
+            self.hits += 1
+        return marshal.loads(data)
+
+    def put(self, key, result):
+        try:
+            data = marshal.dumps(result)
+        except ValueError:
+            # Too deeply nested; parsing isn't recursive, but marshal is
+            return
+        # The size of an entry is the length of its input and of the
+        # marshalled result, which is roughly the memory they take up
+        size = len(key[0]) + len(data)
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = data
+            self.size += size
+
+            entries = self.entries
+            while len(entries) > self.max_entries or self.size > self.max_size:
+                (s, _), data = entries.popitem(last=False)
+                self.size -= len(s) + len(data)
+                self.evictions += 1
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(
+                self.hits, self.misses, self.evictions, len(self.entries), self.size
+            )
+
+
+_cache = None
+
+
+def enable_cache(max_entries=128, max_size=64 * 1024 * 1024):
+    '''
+        Caches the results of loads (and the other load functions), so that
+        parsing the same document again returns a copy of the earlier result.
+        Documents are matched by their exact contents and export_comments.
+        Calling this again replaces the cache with an empty one.
+        
+        :param max_entries: maximum number of documents to keep
+        :param max_size: maximum total size of the cache, counted as the
+                         length of each document plus the size of its
+                         serialized result
+    '''
+    global _cache
+    _cache = _ResultCache(max_entries, max_size)
+
+
+def disable_cache():
+    '''Disables and empties the cache enabled by enable_cache'''
+    global _cache
+    _cache = None
+
+
+def cache_info():
+    '''
+        :returns: CacheInfo(hits, misses, evictions, entries, size) for the
+                  cache enabled by enable_cache, or None if it isn't enabled
+    '''
+    cache = _cache
+    if cache is not None:
+        return cache.info()
+
+
+#
+# Disk cache
+#
+
+
+class _DiskCache(object):
+    '''
+        Cache of parsed files in a directory, one file per document. Entries
+        are marshalled (key, result) pairs, named after a hash of the path
+        and export_comments, so that an entry is replaced when its file
+        changes. The key is checked when reading an entry back, and entries
+        that are stale or can't be read are treated as missing.
+    '''
+
+    suffix = '.hclc'
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.version = (_code_version(), marshal.version)
+        self.lock = threading.Lock()
+
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+        self.size = self._scan()[1]
+
+    def key(self, path, st, export_comments):
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 1000000000)
+        return (
+            os.path.abspath(path),
+            st.st_size,
+            mtime_ns,
+            export_comments,
+            self.version,
+        )
+
+    def _path(self, key):
+        name = hashlib.sha1(marshal.dumps(key[0::3])).hexdigest()
+        return os.path.join(self.directory, name + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry_key, result = marshal.loads(f.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return _missing
+        if entry_key != key:
+            return _missing
+
+        # entries are evicted oldest first, so mark this one as used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        try:
+            data = marshal.dumps((key, result))
+        except ValueError:
+            # Too deeply nested to marshal
+            return
+        if len(data) > self.max_size:
+            return
+
+        # Write to a temporary file and rename it over the entry, so that
+        # other processes never see a partly written entry. If the directory
+        # has gone or can't be written to, the result just isn't cached.
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            _replace(tmp, self._path(key))
+        except (IOError, OSError):
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            return
+
+        with self.lock:
+            # Overwritten entries are counted twice, and other processes
+            # sharing the directory aren't counted at all, so this is only
+            # an estimate until the directory is scanned again
+            self.size += len(data)
+            if self.size > self.max_size:
+                self.size = self._evict()
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        return entries, total
+
+    def _evict(self):
+        # Evict down to below the limit, so that the directory isn't scanned
+        # again on the next few writes
+        try:
+            entries, total = self._scan()
+        except (IOError, OSError):
+            # Try again on a later write
+            return 0
+        limit = self.max_size * 3 // 4
+        entries.sort()
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        return total
+
+
+def _code_version():
+    '''
+        Identifies the code that parsed a result. __version__ is 'master' in
+        a source checkout, where the lexer and parser can change without it
+        changing, so a hash of the modules that produce the results is used
+        as well.
+    '''
+    from . import __version__, lexer, parser
+    from .ply import lex, yacc
+
+    digest = hashlib.sha1()
+    for module in (sys.modules[__name__], lexer, parser, lex, yacc):
+        try:
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        except (AttributeError, IOError, OSError):
+            # Frozen without its source files; the version alone will have
+            # to do
+            pass
+    return (__version__, digest.hexdigest())
+
+
+_replace = getattr(os, 'replace', os.rename)
+
+_disk_cache = None
+
+
+def enable_disk_cache(directory, max_size=256 * 1024 * 1024):
+    '''
+        Caches the results of loading files by path in a directory, so that
+        they are only parsed again when they change. Entries are matched by
+        the absolute path, size and modification time of the file, the
+        export_comments mode and the version of pyhcl, including a hash of
+        its parser code. The directory can be shared by several processes,
+        but only by trusted ones.
+        
+        :param directory: directory to keep the cache in, which is created
+                          if it doesn't exist
+        :param max_size: maximum total size of the entries in the directory.
+                         When it's exceeded, the least recently used entries
+                         are removed
+    '''
+    global _disk_cache
+    _disk_cache = _DiskCache(directory, max_size)
+
+
+def disable_disk_cache():
+    '''Stops using the directory given to enable_disk_cache'''
+    global _disk_cache
+    _disk_cache = None
+
+
+def validate(s, export_comments=None):
+    '''
+        Checks that a string contains valid HCL or JSON. Unlike loads, parsing
+        carries on after a syntax error, so that all of the errors in the
+        string are found in a single pass.
+        
+        :param s: string to check
+        :param export_comments: optional string, see loads
+        
+        :returns: List of ValueError, one per error found. The list is empty
+                  if the string is valid
+    '''
+    try:
+        is_hcl = isHcl(s)
+        if is_hcl or not json_accepts_bytes:
+            s = u(s)
+    except ValueError as e:
+        return [e]
+
+    if is_hcl:
+        return get_parser().validate(s, export_comments=export_comments)
+
+    try:
+        json.loads(s)
+    except ValueError as e:
+        return [e]
+    return []
 
 
 def dumps(*args, **kwargs):
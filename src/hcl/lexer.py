@@ -1,3 +1,4 @@
+from bisect import bisect_right
 import re
 import sys
 
@@ -16,22 +17,83 @@ class _NullLogger(object):
         return self
 
 
+class HclSyntaxError(ValueError):
+    '''
+        Raised for syntax errors found while lexing or parsing a document
+
+        :ivar msg: description of the error
+        :ivar line: line of the error, counted from 1
+        :ivar column: column of the error, counted from 0
+        :ivar offset: index of the error in the input
+        :ivar expected: tuple of the tokens that the parser expected to find,
+                        empty for errors found by the lexer
+    '''
+
+    def __init__(self, msg, line, column, offset, expected=()):
+        message = "Line %d, column %d, index %d: %s" % (line, column, offset, msg)
+        if expected:
+            message = "%s; expected %s" % (message, ', '.join(expected))
+        ValueError.__init__(self, message)
+
+        self.msg = msg
+        self.line = line
+        self.column = column
+        self.offset = offset
+        self.expected = tuple(expected)
+
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (self.msg, self.line, self.column, self.offset, self.expected),
+        )
+
+
+_newlines = re.compile('\n')
+
+
+def _position(lexer, offset):
+    # Line and column of an offset into the input of a ply lexer. The offsets
+    # that lines start at are only needed for errors, so they're found the
+    # first time an error is reported, and kept until the input changes.
+    lexdata = lexer.lexdata
+    index = getattr(lexer, 'line_index', None)
+    if index is None or index[0] is not lexdata:
+        line_starts = [0]
+        line_starts.extend(m.end() for m in _newlines.finditer(lexdata))
+        index = lexer.line_index = (lexdata, line_starts)
+
+    line_starts = index[1]
+    line = bisect_right(line_starts, offset)
+    return line, offset - line_starts[line - 1]
+
+
+def _count_lines(lexer, start, end):
+    # Counts the newlines in lexdata[start:end] into the line number
+    lexer.lineno += lexer.lexdata.count('\n', start, end)
+
+
 def _raise_error(t, message=None):
-    lexpos = t.lexer.lexpos
-    lexdata = t.lexer.lexdata
-    lineno = t.lexer.lineno
-    column = _find_column(lexdata, t)
+    lexer = t.lexer
+    lexpos = lexer.lexpos
     if message is None:
-        message = "Illegal character '%s'" % lexdata[lexpos]
-    raise ValueError(
-        "Line %d, column %d, index %d: %s" % (lineno, column, lexpos, message)
-    )
+        message = "Illegal character '%s'" % lexer.lexdata[lexpos]
+    line, column = _position(lexer, lexpos)
+    raise HclSyntaxError(message, line, column, lexpos)
 
 
-def _find_column(input, token):
-    last_cr = input.rfind('\n', 0, token.lexpos)
-    column = (token.lexpos - last_cr) - 1
-    return column
+# Tabs at the start of each line of a '<<-' heredoc are removed
+_heredoc_tabs = re.compile('^\t+', re.MULTILINE)
+
+
+def _heredoc_terminator(identifier, is_tabbed):
+    # Matches the first line of a heredoc body that ends with the identifier,
+    # excluding a trailing '\r'. Trailing whitespace is allowed in a tabbed
+    # heredoc, as the line is stripped before comparing it.
+    if is_tabbed:
+        pattern = r'^[^\n]*%s[^\S\n]*$'
+    else:
+        pattern = r'^[^\n]*%s(?=\r?$)'
+    return re.compile(pattern % re.escape(identifier), re.MULTILINE | re.UNICODE)
 
 
 class Lexer(object):
@@ -73,12 +135,13 @@ class Lexer(object):
     states = (
         ('stringdollar', 'exclusive'),
         ('string', 'exclusive'),
-        ('heredoc', 'exclusive'),
-        ('tabbedheredoc', 'exclusive'),
     )
 
     can_export_comments = []
 
+    # Compiled ply lexers, keyed by (class, export_comments, optimize)
+    _masters = {}
+
     def t_BOOL(self, t):
         r'(true)|(false)'
         t.value = t.value == 'true'
@@ -168,19 +231,18 @@ class Lexer(object):
         # rel_pos is the begining of the unconsumed part of the string. It will
         # get modified when consuming escaped characters
         t.lexer.rel_pos = t.lexer.lexpos
-        # The value of the consumed part of the string
-        t.lexer.string_value = u''
+        # The consumed parts of the string, joined once the string ends
+        t.lexer.string_parts = []
         t.lexer.begin('string')
 
     def t_string_escapedchar(self, t):
         # If a quote or backslash is escaped, build up the string by ignoring
         # the escape character. Should this be done for other characters?
         r'(?<=\\)(\"|\\)'
-        t.lexer.string_value += (
-            t.lexer.lexdata[t.lexer.rel_pos : t.lexer.lexpos - 2] + t.value
-        )
+        parts = t.lexer.string_parts
+        parts.append(t.lexer.lexdata[t.lexer.rel_pos : t.lexer.lexpos - 2])
+        parts.append(t.value)
         t.lexer.rel_pos = t.lexer.lexpos
-        pass
 
     def t_string_stringdollar(self, t):
         # Left brace preceeded by a dollar
@@ -189,31 +251,31 @@ class Lexer(object):
         t.lexer.begin('stringdollar')
 
     def t_string_ignoring(self, t):
-        # Ignore everything except for a quote
-        r'[^\"]'
+        # Ignore runs of everything except for a quote, an escaped character
+        # or the start of a '${' expression. These are consumed in bulk
+        # rather than one character at a time, as strings can be very long.
+        r'(?:[^\"\\{]+|(?<!\\)\\|(?<!\$)\{)+'
         pass
 
     def t_string_STRING(self, t):
         # End of the string
         r'\"'
-        t.value = (
-            t.lexer.string_value + t.lexer.lexdata[t.lexer.rel_pos : t.lexer.lexpos - 1]
-        )
-        t.lexer.lineno += t.lexer.lexdata[t.lexer.abs_start : t.lexer.lexpos - 1].count(
-            '\n'
-        )
+        parts = t.lexer.string_parts
+        parts.append(t.lexer.lexdata[t.lexer.rel_pos : t.lexer.lexpos - 1])
+        t.value = u''.join(parts)
+        # The token starts at the opening quote, not this closing one
+        t.lexpos = t.lexer.abs_start - 1
+        _count_lines(t.lexer, t.lexer.abs_start, t.lexer.lexpos - 1)
         t.lexer.begin('INITIAL')
         return t
 
     def t_string_eof(self, t):
-        t.lexer.lineno += t.lexer.lexdata[t.lexer.abs_start : t.lexer.lexpos].count(
-            '\n'
-        )
+        _count_lines(t.lexer, t.lexer.abs_start, t.lexer.lexpos)
         _raise_error(t, 'EOF before closing string quote')
 
     def t_stringdollar_dontcare(self, t):
-        # Ignore everything except for braces
-        r'[^\{\}]'
+        # Ignore runs of everything except for braces
+        r'[^\{\}]+'
         pass
 
     def t_stringdollar_lbrace(self, t):
@@ -229,97 +291,82 @@ class Lexer(object):
             t.lexer.begin('string')
 
     def t_stringdollar_eof(self, t):
-        t.lexer.lineno += t.lexer.lexdata[t.lexer.abs_start : t.lexer.lexpos].count(
-            '\n'
-        )
+        _count_lines(t.lexer, t.lexer.abs_start, t.lexer.lexpos)
         _raise_error(t, "EOF before closing '${}' expression")
 
-    def _init_heredoc(self, t):
-        t.lexer.here_start = t.lexer.lexpos
+    def _scan_heredoc(self, t, is_tabbed):
+        lexer = t.lexer
+        lexdata = lexer.lexdata
+        here_start = lexer.lexpos
 
         if t.value.endswith('\r\n'):
-            t.lexer.newline_chars = 2
+            newline_chars = 2
         else:
-            t.lexer.newline_chars = 1
+            newline_chars = 1
 
-        if t.lexer.is_tabbed:
+        if is_tabbed:
             # Chop '<<-'
             chop = 3
         else:
             # Chop '<<'
             chop = 2
 
-        t.lexer.here_identifier = t.value[chop : -t.lexer.newline_chars]
+        here_identifier = t.value[chop:-newline_chars]
         # We consumed a newline in the regex so bump the counter
-        t.lexer.lineno += 1
-
-    def t_tabbedheredoc(self, t):
-        r'<<-\S+\r?\n'
-        t.lexer.is_tabbed = True
-        self._init_heredoc(t)
-        t.lexer.begin('tabbedheredoc')
-
-    def t_heredoc(self, t):
-        r'<<\S+\r?\n'
-        t.lexer.is_tabbed = False
-        self._init_heredoc(t)
-        t.lexer.begin('heredoc')
+        _count_lines(lexer, here_start - 1, here_start)
+        t.lineno = lexer.lineno
 
-    def _end_heredoc(self, t):
-        if t.lexer.is_tabbed:
+        # Locate the line ending with the identifier in a single search rather
+        # than matching the body line by line
+        m = _heredoc_terminator(here_identifier, is_tabbed).search(
+            lexdata, here_start
+        )
+        if m is None:
+            _count_lines(lexer, here_start, len(lexdata))
+            lexer.lexpos = t.lexpos = len(lexdata)
+            _raise_error(t, 'EOF before closing heredoc')
+
+        line_start, line_end = m.span()
+        if lexdata[line_end - 1] == '\r':
+            # Only possible for tabbed heredocs, which match trailing whitespace
+            line_end -= 1
+
+        value = lexdata[line_start:line_end]
+        if is_tabbed:
             # Strip leading tabs
-            value = t.value.strip()
-        else:
-            value = t.value
+            value = value.strip()
 
-        if value == t.lexer.here_identifier:
+        if value == here_identifier:
             # Handle case where identifier is on a line of its own. Need to
-            # subtract the current line and the newline characters from
-            # the previous line to get the endpos
-            endpos = t.lexer.lexpos - (t.lexer.newline_chars + len(t.value))
-        elif value.endswith(t.lexer.here_identifier):
+            # subtract the newline characters from the previous line to get
+            # the endpos
+            endpos = line_start - newline_chars
+        else:
             # Handle case where identifier is at the end of the line. Need to
             # subtract the identifier from to get the endpos
-            endpos = t.lexer.lexpos - len(t.lexer.here_identifier)
-        else:
-            return
+            endpos = line_end - len(here_identifier)
 
-        entire_string = t.lexer.lexdata[t.lexer.here_start : endpos]
+        entire_string = lexdata[here_start:endpos]
 
-        if t.lexer.is_tabbed:
-            # Get rid of any initial tabs, and remove any tabs preceded by
-            # a new line
-            chopped_starting_tabs = re.sub('^\t*', '', entire_string)
-            t.value = re.sub('\n\t*', '\n', chopped_starting_tabs)
+        if is_tabbed:
+            # Get rid of any tabs at the start of each line
+            t.value = _heredoc_tabs.sub('', entire_string)
         else:
             t.value = entire_string
 
-        t.lexer.lineno += t.lexer.lexdata[t.lexer.here_start : t.lexer.lexpos].count(
-            '\n'
-        )
-        t.lexer.begin('INITIAL')
+        # t.lexpos is left at the '<<' that starts the heredoc
+        t.type = 'STRING'
+        _count_lines(lexer, here_start, line_end)
+        lexer.lexpos = line_end
         return t
 
-    def t_tabbedheredoc_STRING(self, t):
-        r'^\t*.+?(?=\r?$)'
-        return self._end_heredoc(t)
-
-    def t_heredoc_STRING(self, t):
-        r'^.+?(?=\r?$)'
-        return self._end_heredoc(t)
-
-    def t_heredoc_ignoring(self, t):
-        r'.+|\n'
-        pass
-
-    def t_heredoc_eof(self, t):
-        t.lexer.lineno += t.lexer.lexdata[t.lexer.here_start : t.lexer.lexpos].count(
-            '\n'
-        )
-        _raise_error(t, 'EOF before closing heredoc')
+    def t_tabbedheredoc(self, t):
+        r'<<-\S+\r?\n'
+        return self._scan_heredoc(t, True)
 
-    t_tabbedheredoc_ignoring = t_heredoc_ignoring
-    t_tabbedheredoc_eof = t_heredoc_eof
+    def t_heredoc(self, t):
+        r'<<\S+\r?\n'
+        return self._scan_heredoc(t, False)
 
     t_LEFTBRACE = r'\{'
     t_RIGHTBRACE = r'\}'
@@ -336,7 +383,7 @@ class Lexer(object):
 
     def t_MULTICOMMENT(self, t):
         r'/\*(.|\n)*?(\*/)'
-        t.lexer.lineno += t.value.count('\n')
+        _count_lines(t.lexer, t.lexpos, t.lexer.lexpos)
         if 'MULTICOMMENT' in self.can_export_comments:
             return t
 
@@ -370,7 +417,18 @@ class Lexer(object):
         else:
             _raise_error(t)
 
-    def __init__(self, export_comments=None):
+    def __init__(self, export_comments=None, optimize=True, errors=None):
+        '''
+            :param export_comments: 'LINE', 'MULTILINE', 'ALL' or None; see
+                hcl.loads
+            :param optimize: if True, the lexer rules are trusted and PLY
+                doesn't validate them (or check the type of returned tokens)
+            :param errors: if a list is given, errors are appended to it and
+                lexing carries on after the offending input instead of
+                raising ValueError
+        '''
+        self.errors = errors
+
         if export_comments is not None:
             if export_comments == 'LINE':
                 self.can_export_comments = ['COMMENT']
@@ -384,15 +442,65 @@ class Lexer(object):
                     '`export_comments`. given: `%s`.' % export_comments
                 )
 
-        self.lex = lex.lex(
-            module=self,
-            debug=False,
-            reflags=(re.UNICODE | re.MULTILINE),
-            errorlog=_NullLogger(),
-        )
+        # Building the lexer reflects over this class and compiles the master
+        # regexes, so it's only done once per mode; each Lexer gets a clone
+        key = (type(self), export_comments, optimize)
+        master = self._masters.get(key)
+        if master is None:
+            # The rules are bound to the instance the master is built from,
+            # which is then kept for the life of the process. Build it from an
+            # instance of its own, so that this Lexer (and its errors) aren't
+            # kept alive with it
+            owner = object.__new__(type(self))
+            owner.errors = None
+            owner.can_export_comments = self.can_export_comments
+
+            # lextab=False: the compiled regexes are never read from or
+            # written to a lextab module
+            master = lex.lex(
+                module=owner,
+                debug=False,
+                optimize=optimize,
+                lextab=False,
+                reflags=(re.UNICODE | re.MULTILINE),
+                errorlog=_NullLogger(),
+            )
+            self._masters[key] = master
+
+        self.lex = master.clone()
 
     def input(self, s):
+        # A Lexer can be reused for several inputs, so reset its state
+        self.lex.begin('INITIAL')
+        self.lex.lineno = 1
         return self.lex.input(s)
 
+    def position(self, offset):
+        '''
+            :returns: (line, column) of an offset into the input
+        '''
+        return _position(self.lex, offset)
+
     def token(self):
-        return self.lex.token()
+        if self.errors is None:
+            return self.lex.token()
+
+        while True:
+            try:
+                return self.lex.token()
+            except ValueError as e:
+                self.errors.append(e)
+                self._recover()
+
+    def _recover(self):
+        # Skips past the input that caused an error. Unterminated strings,
+        # heredocs and comments run to the end of the input, so there's
+        # nothing left to lex after them.
+        lex = self.lex
+        if lex.lexstate != 'INITIAL':
+            lex.begin('INITIAL')
+            lex.lexpos = lex.lexlen
+        elif lex.lexdata.startswith('/*', lex.lexpos):
+            lex.lexpos = lex.lexlen
+        elif lex.lexpos < lex.lexlen:
+            lex.lexpos += 1
@@ -1,7 +1,9 @@
+from functools import partial
 from os.path import abspath, dirname, exists, join
 import sys
+import threading
 
-from .lexer import Lexer
+from .lexer import HclSyntaxError, Lexer, _position
 from .ply import yacc
 
 import inspect
@@ -21,6 +23,10 @@ else:
     fobj = tempfile.NamedTemporaryFile()
     pickle_file = fobj.name
 
+# Tables generated at build time by setup.py. These are only used when the
+# grammar signature matches, so a stale module is regenerated and not trusted
+tabmodule = __package__ + '._parsetab'
+
 
 if sys.version_info[0] < 3:
 
@@ -96,27 +102,34 @@ class HclParser(object):
         d = {}
 
         for k, v in lt:
-            if k in d.keys() and not replace:
-                if type(d[k]) is list:
-                    d[k].append(v)
+            if not replace and k in d:
+                dv = d[k]
+                if type(dv) is list:
+                    dv.append(v)
                 else:
-                    d[k] = [d[k], v]
-            else:
-                if isinstance(v, dict):
-                    dd = d.setdefault(k, {})
+                    d[k] = [dv, v]
+            elif isinstance(v, dict):
+                dd = d.setdefault(k, {})
+                if type(dd) is list:
                     for kk, vv in iteritems(v):
-                        if type(dd) == list:
-                            dd.append({kk: vv})
-                        elif kk in dd.keys():
-                            if hasattr(vv, 'items'):
-                                for k2, v2 in iteritems(vv):
-                                    dd[kk][k2] = v2
-                            else:
-                                d[k] = [dd, {kk: vv}]
-                        else:
+                        dd.append({kk: vv})
+                elif v:
+                    if not isinstance(dd, dict):
+                        raise ValueError(
+                            "Cannot merge block '%s' into a value that isn't an object"
+                            % k
+                        )
+                    for kk, vv in iteritems(v):
+                        if kk not in dd:
                             dd[kk] = vv
-                else:
-                    d[k] = v
+                        elif hasattr(vv, 'items'):
+                            merged = dd[kk]
+                            for k2, v2 in iteritems(vv):
+                                merged[k2] = v2
+                        else:
+                            d[k] = [dd, {kk: vv}]
+            else:
+                d[k] = v
 
         return d
 
@@ -125,52 +138,51 @@ class HclParser(object):
         top : empty
             | objectlist
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = self.objectlist_flat(p[1], True)
 
     def p_empty_0(self, p):
         '''
         empty :
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = []
 
     def p_objectlist_0(self, p):
         "objectlist : objectitem"
-        if DEBUG:
-            self.print_p(p)
         p[0] = [p[1]]
 
     def p_objectlist_1(self, p):
         "objectlist : objectlist objectitem"
-        if DEBUG:
-            self.print_p(p)
-        p[0] = p[1] + [p[2]]
+        # append in place, copying the list on each item is quadratic
+        p[1].append(p[2])
+        p[0] = p[1]
 
     def p_objectlist_2(self, p):
         "objectlist : objectlist COMMA objectitem"
-        if DEBUG:
-            self.print_p(p)
-        p[0] = p[1] + [p[3]]
+        p[1].append(p[3])
+        p[0] = p[1]
+
+    # Error recovery: a syntax error resynchronizes at the next item of the
+    # enclosing object list. These are only reached by validate(), as p_error
+    # raises when parsing normally
+
+    def p_objectlist_3(self, p):
+        "objectlist : error"
+        p[0] = []
+
+    def p_objectlist_4(self, p):
+        "objectlist : objectlist error"
+        p[0] = p[1]
 
     def p_object_0(self, p):
         "object : LEFTBRACE objectlist RIGHTBRACE"
-        if DEBUG:
-            self.print_p(p)
         p[0] = self.objectlist_flat(p[2], False)
 
     def p_object_1(self, p):
         "object : LEFTBRACE objectlist COMMA RIGHTBRACE"
-        if DEBUG:
-            self.print_p(p)
         p[0] = self.objectlist_flat(p[2], False)
 
     def p_object_2(self, p):
         "object : LEFTBRACE RIGHTBRACE"
-        if DEBUG:
-            self.print_p(p)
         p[0] = {}
 
     def p_objectkey_0(self, p):
@@ -178,8 +190,6 @@ class HclParser(object):
         objectkey : IDENTIFIER
                   | STRING
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1]
 
     def p_objectkey_1(self, p):
@@ -193,14 +203,10 @@ class HclParser(object):
                   | IDENTIFIER DIVIDE number
                   | number DIVIDE IDENTIFIER
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = (str(p[1]), str(p[2]), str(p[3]))
 
     def p_objectbrackets_0(self, p):
         "objectbrackets : IDENTIFIER LEFTBRACKET objectkey RIGHTBRACKET"
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1] + p[2] + p[3] + p[4]
 
     def p_objectbrackets_1(self, p):
@@ -208,8 +214,6 @@ class HclParser(object):
         objectbrackets : IDENTIFIER LEFTBRACKET objectkey RIGHTBRACKET PERIOD IDENTIFIER
                        | IDENTIFIER LEFTBRACKET NUMBER RIGHTBRACKET PERIOD IDENTIFIER
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1] + p[2] + str(p[3]) + p[4] + p[5] + p[6]
 
     def p_objectitem_0(self, p):
@@ -234,14 +238,10 @@ class HclParser(object):
                    | objectkey COLON objectbrackets
                    | objectkey COLON booleanexp
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = (p[1], p[3])
 
     def p_objectitem_1(self, p):
         "objectitem : block"
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1]
 
     def p_objectitem_2(self, p):
@@ -273,8 +273,6 @@ class HclParser(object):
                    | objectkey EQUAL booleanexp QMARK BOOL COLON function
                    | objectkey EQUAL booleanexp QMARK BOOL COLON BOOL
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = (p[1], p[3] + p[4] + str(p[5]) + p[6] + str(p[7]))
 
     def p_operator_0(self, p):
@@ -286,8 +284,6 @@ class HclParser(object):
                  | LE
                  | GE
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1]
 
     def p_booleanexp_0(self, p):
@@ -296,20 +292,14 @@ class HclParser(object):
                    | objectkey operator number
                    | number operator objectkey
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = str(p[1]) + p[2] + str(p[3])
 
     def p_block_0(self, p):
         "block : objectkey object"
-        if DEBUG:
-            self.print_p(p)
         p[0] = (p[1], p[2])
 
     def p_block_1(self, p):
         "block : objectkey block"
-        if DEBUG:
-            self.print_p(p)
         p[0] = (p[1], {p[2][0]: p[2][1]})
 
     def p_list_0(self, p):
@@ -317,8 +307,6 @@ class HclParser(object):
         list : LEFTBRACKET listitems RIGHTBRACKET
              | LEFTBRACKET listitems COMMA RIGHTBRACKET
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[2]
 
     def p_list_1(self, p):
@@ -326,32 +314,24 @@ class HclParser(object):
         list : LEFTBRACKET RIGHTBRACKET
              | LEFTPAREN RIGHTPAREN
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = []
 
     def p_list_2(self, p):
         '''
         list : LEFTPAREN LEFTBRACKET listitems RIGHTBRACKET PERIOD PERIOD PERIOD RIGHTPAREN
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = [p[3]] + [p[5] + p[6] + p[7]]
 
     def p_list_of_lists_0(self, p):
         '''
         list_of_lists : list COMMA list
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1], p[3]
 
     def p_list_of_lists_1(self, p):
         '''
         list_of_lists : list_of_lists COMMA list
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1] + (p[3],)
 
     def p_function_0(self, p):
@@ -359,9 +339,6 @@ class HclParser(object):
         function : IDENTIFIER LEFTPAREN listitems RIGHTPAREN
                  | IDENTIFIER LEFTPAREN list_of_lists RIGHTPAREN
         '''
-        if DEBUG:
-            self.print_p(p)
-
         p[0] = p[1] + p[2] + self.flatten(p[3]) + p[4]
 
     def p_function_1(self, p):
@@ -369,27 +346,18 @@ class HclParser(object):
         function : IDENTIFIER LEFTPAREN listitems COMMA RIGHTPAREN
                  | IDENTIFIER LEFTPAREN list_of_lists COMMA RIGHTPAREN
         '''
-        if DEBUG:
-            self.print_p(p)
-
         p[0] = p[1] + p[2] + self.flatten(p[3]) + p[5]
 
     def p_function_2(self, p):
         '''
         function : IDENTIFIER LEFTPAREN list PERIOD PERIOD PERIOD RIGHTPAREN
         '''
-        if DEBUG:
-            self.print_p(p)
-
         p[0] = p[1] + p[2] + self.flatten(p[3]) + p[4] + p[5] + p[6] + p[7]
 
     def p_function_3(self, p):
         '''
         function : IDENTIFIER LEFTPAREN LEFTBRACKET list_of_lists RIGHTBRACKET PERIOD PERIOD PERIOD RIGHTPAREN
         '''
-        if DEBUG:
-            self.print_p(p)
-
         p[0] = (
             p[1] + p[2] + p[3] + self.flatten(p[4]) + p[5] + p[6] + p[7] + p[8] + p[9]
         )
@@ -431,8 +399,6 @@ class HclParser(object):
                   | objectkey COMMA
                   | list COMMA
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = [p[1]]
 
     def p_listitems_1(self, p):
@@ -441,9 +407,9 @@ class HclParser(object):
                   | listitems COMMA function
                   | listitems COMMA objectkey
         '''
-        if DEBUG:
-            self.print_p(p)
-        p[0] = p[1] + [p[3]]
+        # append in place, copying the list on each item is quadratic
+        p[1].append(p[3])
+        p[0] = p[1]
 
     def p_listitems_2(self, p):
         '''
@@ -453,24 +419,18 @@ class HclParser(object):
                   | objectkey COMMA object
                   | objectkey COMMA list
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = [p[1], p[3]]
 
     def p_listitems_3(self, p):
         '''
         listitems : objectkey COMMA IDENTIFIER ASTERISK_PERIOD IDENTIFIER
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = [p[1], p[3] + p[4] + p[5]]
 
     def p_listitems_4(self, p):
         '''
         listitems : objectkey list
         '''
-        if DEBUG:
-            self.print_p(p)
         p[2].insert(0, p[1])
         p[0] = p[2]
 
@@ -480,8 +440,6 @@ class HclParser(object):
                   | listitems COMMA MULTICOMMENT
         '''
         # skip comments in lists
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1]
 
     def p_listitem_0(self, p):
@@ -491,84 +449,60 @@ class HclParser(object):
                  | objectkey
                  | objectbrackets
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1]
 
     def p_listitem_1(self, p):
         '''
         listitem : IDENTIFIER ASTERISK_PERIOD IDENTIFIER
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1] + p[2] + p[3]
 
     def p_number_0(self, p):
         "number : int"
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1]
 
     def p_number_1(self, p):
         "number : float"
-        if DEBUG:
-            self.print_p(p)
         p[0] = float(p[1])
 
     def p_number_2(self, p):
         "number : int exp"
-        if DEBUG:
-            self.print_p(p)
         p[0] = float("{0}{1}".format(p[1], p[2]))
 
     def p_number_3(self, p):
         "number : float exp"
-        if DEBUG:
-            self.print_p(p)
         p[0] = float("{0}{1}".format(p[1], p[2]))
 
     def p_number_4(self, p):
         '''
         number : number ADD number
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1] + p[3]
 
     def p_number_5(self, p):
         '''
         number : number MINUS number
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1] - p[3]
 
     def p_number_6(self, p):
         '''
         number : number MULTIPLY number
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1] * p[3]
 
     def p_number_7(self, p):
         '''
         number : number DIVIDE number
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1] / p[3]
 
     def p_int_0(self, p):
         "int : MINUS int"
-        if DEBUG:
-            self.print_p(p)
         p[0] = -p[2]
 
     def p_int_1(self, p):
         "int : NUMBER"
-        if DEBUG:
-            self.print_p(p)
         p[0] = p[1]
 
     def p_float_0(self, p):
@@ -581,14 +515,10 @@ class HclParser(object):
 
     def p_exp_0(self, p):
         "exp : EPLUS NUMBER"
-        if DEBUG:
-            self.print_p(p)
         p[0] = "e{0}".format(p[2])
 
     def p_exp_1(self, p):
         "exp : EMINUS NUMBER"
-        if DEBUG:
-            self.print_p(p)
         p[0] = "e-{0}".format(p[2])
 
     def p_comment_0(self, p):
@@ -596,49 +526,163 @@ class HclParser(object):
         block : COMMENT
               | MULTICOMMENT
         '''
-        if DEBUG:
-            self.print_p(p)
         p[0] = ("comment-L{:03d}".format(p.lineno(1)), p[1])
 
     # useful for debugging the parser
-    def print_p(self, p):
-        if DEBUG:
+    def print_p(self, p, name=None):
+        if name is None:
             name = inspect.getouterframes(inspect.currentframe(), 2)[1][3]
-            print(
-                '%20s: %s' % (name, ' | '.join([str(p[i]) for i in range(0, len(p))]))
-            )
+        print('%20s: %s' % (name, ' | '.join([str(p[i]) for i in range(0, len(p))])))
 
-    def p_error(self, p):
-        # Derived from https://groups.google.com/forum/#!topic/ply-hack/spqwuM1Q6gM
+    def _bind_actions(self, debug):
+        '''
+            Binds the grammar actions called by the LR parser. The actions
+            themselves don't check DEBUG; when debugging each one is wrapped
+            so that print_p traces the reduction first.
+        '''
+        for prod in self.yacc.productions:
+            if prod.func:
+                action = getattr(self, prod.func)
+                if debug:
+                    action = self._trace_action(action)
+                prod.callable = action
+        self._debug_actions = debug
 
-        # Ugly hack since Ply doesn't provide any useful error information
-        try:
-            frame = inspect.currentframe()
-            cvars = frame.f_back.f_locals
-            expected = "; expected %s" % (
-                ', '.join(cvars['actions'][cvars['state']].keys())
-            )
-        except:
-            expected = ""
+    def _trace_action(self, action):
+        name = action.__name__
+
+        def traced(p):
+            self.print_p(p, name)
+            action(p)
+
+        return traced
 
+    def p_error(self, p):
+        # Only used when parsing with self.yacc directly; parse() and
+        # validate() give each call an error handler of its own
+        self._error(self.yacc, None, p)
+
+    def _error(self, parser, errors, p):
+        # The lexer is usually a Lexer, but may be the ply lexer it wraps
+        lexer = parser.lexer
+        lexer = getattr(lexer, 'lex', lexer)
         if p is not None:
-            msg = "Line %d, column %d: unexpected %s%s" % (
-                p.lineno,
-                p.lexpos,
-                p.type,
-                expected,
-            )
+            offset = p.lexpos
+            msg = "unexpected %s" % p.type
         else:
-            msg = "Unexpected end of file%s" % expected
+            offset = len(lexer.lexdata)
+            msg = "unexpected end of file"
+
+        line, column = _position(lexer, offset)
+        error = HclSyntaxError(msg, line, column, offset, parser.expected_tokens())
+        if errors is None:
+            raise error
 
-        raise ValueError(msg)
+        # Collecting errors for validate(); let the parser recover
+        errors.append(error)
 
-    def __init__(self):
+    def __init__(self, write_tables=False, optimize=None):
+        '''
+            :param write_tables: if True and the LALR tables have to be
+                generated, they are also written out as an importable module
+                (see tabmodule). setup.py does this when building the package.
+            :param optimize: if True, the grammar and lexer rules are trusted
+                and PLY skips validating them (which involves reading the
+                source of this module). Defaults to True unless DEBUG is set.
+        '''
+        if optimize is None:
+            optimize = not DEBUG
+        self.optimize = optimize
+
+        # The LALR tables are loaded from tabmodule or pickle_file, and are
+        # only regenerated when the grammar signature no longer matches
         self.yacc = yacc.yacc(
-            module=self, debug=False, optimize=1, debugfile=pickle_file
+            module=self,
+            debug=False,
+            optimize=optimize,
+            picklefile=pickle_file,
+            tabmodule=tabmodule,
+            write_tables=write_tables,
+            outputdir=dirname(__file__),
+            errorlog=None if DEBUG else yacc.NullLogger(),
         )
+        self._bind_actions(DEBUG)
+
+    def _parse(self, s, lexer, errors):
+        # The tables in self.yacc are shared, but everything that changes
+        # while parsing is kept on a clone of it and on the lexer, so that
+        # several threads can use this parser at once
+        if DEBUG != self._debug_actions:
+            self._bind_actions(DEBUG)
+        parser = self.yacc.clone()
+        parser.errorfunc = partial(self._error, parser, errors)
+        try:
+            return parser.parse(s, lexer=lexer, debug=DEBUG)
+        finally:
+            # breaks the reference cycle through the error handler
+            parser.errorfunc = None
+
+    def parse(self, s, export_comments=None, lexer=None):
+        '''
+            Parses s. This is safe to call from several threads at once,
+            as long as they don't share a lexer.
+
+            :param lexer: a Lexer to reuse, rather than creating one for this
+                document. export_comments is ignored if this is given.
+        '''
+        if lexer is None:
+            lexer = Lexer(export_comments=export_comments, optimize=self.optimize)
+        return self._parse(s, lexer, None)
+
+    def validate(self, s, export_comments=None):
+        '''
+            Parses s, carrying on after syntax errors instead of stopping at
+            the first one. Parsing resumes at the next item of the enclosing
+            object, so errors close to a previous one may not be reported.
 
-    def parse(self, s, export_comments=None):
-        return self.yacc.parse(
-            s, lexer=Lexer(export_comments=export_comments), debug=DEBUG
+            :returns: list of ValueError, one per error found. The list is
+                      empty if s is valid
+        '''
+        errors = []
+        lexer = Lexer(
+            export_comments=export_comments, optimize=self.optimize, errors=errors
         )
+        try:
+            self._parse(s, lexer, errors)
+        except ValueError as e:
+            # Not a syntax error, such as a block merged into a value
+            errors.append(e)
+        return errors
+
+
+# Building the LALR tables is by far the most expensive part of parsing a
+# document, so a single parser instance is shared by everything in the process
+
+_parser = None
+_parser_lock = threading.Lock()
+
+
+def get_parser():
+    '''
+        Returns the process-wide HclParser instance, building it on first use.
+        The instance can be used by several threads at once.
+
+        :returns: HclParser
+    '''
+    global _parser
+    parser = _parser
+    if parser is None:
+        with _parser_lock:
+            if _parser is None:
+                _parser = HclParser()
+            parser = _parser
+    return parser
+
+
+def reset_parser():
+    '''
+        Discards the shared parser, so that the next call to get_parser()
+        builds a new one. Useful after changing the grammar at runtime.
+    '''
+    global _parser
+    _parser = None
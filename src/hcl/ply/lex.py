@@ -63,7 +63,10 @@ class LexError(Exception):
 
 
 # Token class.  This class is used to represent the tokens produced.
+# Lexers produce a great many of these, so they don't carry a __dict__.
 class LexToken(object):
+    __slots__ = ('type', 'value', 'lineno', 'lexpos', 'lexer')
+
     def __str__(self):
         return 'LexToken(%s,%r,%d,%d)' % (self.type, self.value, self.lineno, self.lexpos)
 
@@ -145,6 +148,7 @@ class Lexer:
 
     def clone(self, object=None):
         c = copy.copy(self)
+        c.lexstatestack = list(self.lexstatestack)
 
         # If the object parameter has been supplied, it means we are attaching the
         # lexer to a new object.  In this case, we have to rebind all methods in
@@ -64,7 +64,12 @@
 import re
 import types
 import sys
+import importlib
+import os.path
 import inspect
+import tempfile
+
+__tabversion__ = '3.10'
 
 #-----------------------------------------------------------------------------
 #                     === User configurable parameters ===
@@ -116,6 +121,10 @@ class NullLogger(object):
 class YaccError(Exception):
     pass
 
+# Exception raised when a table cache was written by an incompatible version
+class VersionError(YaccError):
+    pass
+
 # Format the result message that the parser produces when running in debug mode.
 def format_result(r):
     repr_str = repr(r)
@@ -153,7 +162,9 @@ def format_stack_entry(r):
 #        .lexpos     = Starting lex position
 #        .endlexpos  = Ending lex position (optional, set automatically)
 
-class YaccSymbol:
+class YaccSymbol(object):
+    __slots__ = ('type', 'value', 'lineno', 'endlineno', 'lexpos', 'endlexpos')
+
     def __str__(self):
         return self.type
 
@@ -169,7 +180,9 @@ class YaccSymbol:
 # for a symbol.  The lexspan() method returns a tuple (lexpos,endlexpos)
 # representing the range of positional information for a symbol.
 
-class YaccProduction:
+class YaccProduction(object):
+    __slots__ = ('slice', 'stack', 'lexer', 'parser')
+
     def __init__(self, s, stack=None):
         self.slice = s
         self.stack = stack
@@ -224,18 +237,35 @@ class YaccProduction:
 # The LR Parsing engine.
 # -----------------------------------------------------------------------------
 
-class LRParser:
+class LRParser(object):
     def __init__(self, lrtab, errorf):
         self.productions = lrtab.lr_productions
         self.action = lrtab.lr_action
         self.goto = lrtab.lr_goto
         self.errorfunc = errorf
         self.set_defaulted_states()
+        self.set_expected_tokens()
         self.errorok = True
+        self.state = None
+        self.lexer = None
 
     def errok(self):
         self.errorok = True
 
+    # Per-call parsers.
+    # parse() keeps its state (the stacks, the current state, the lexer and
+    # the errorok flag) on the parser object, so a parser can only parse one
+    # input at a time.  The tables are never modified by parsing though, so
+    # clone() returns a parser that shares them but has its own state.  Any
+    # number of threads can then parse at once, each with its own clone.
+    def clone(self):
+        parser = object.__new__(self.__class__)
+        parser.__dict__.update(self.__dict__)
+        parser.errorok = True
+        parser.state = None
+        parser.lexer = None
+        return parser
+
     def restart(self):
         del self.statestack[:]
         del self.symstack[:]
@@ -262,6 +292,20 @@ class LRParser:
     def disable_defaulted_states(self):
         self.defaulted_states = {}
 
+    # Expected tokens support.
+    # For each parser state, this records the tokens that have an entry in the
+    # action table, in table order.  Error handlers can call expected_tokens()
+    # to report what the parser was looking for when an error occurred.
+    def set_expected_tokens(self):
+        self.expected = {}
+        for state, actions in self.action.items():
+            self.expected[state] = tuple(t for t in actions if t != 'error')
+
+    def expected_tokens(self, state=None):
+        if state is None:
+            state = self.state
+        return self.expected.get(state, ())
+
     # parse().
     #
     # This is the core parsing engine.  To operate, it requires a lexer object.
@@ -269,12 +313,23 @@ class LRParser:
     # see the various rule reductions and parsing steps.  tracking turns on position
     # tracking.  In this mode, symbols will record the starting/ending line number and
     # character index.
+    #
+    # The common case of neither debugging nor tracking is handled by
+    # parseopt_notrack(), a copy of parsedebug() with those branches removed.
 
     def parse(self, input=None, lexer=None, debug=False, tracking=False):
-        # If debugging has been specified as a flag, turn it into a logging object
-        if isinstance(debug, int) and debug:
-            debug = PlyLogger(sys.stderr)
+        if debug or tracking:
+            # If debugging has been specified as a flag, turn it into a logging object
+            if isinstance(debug, int) and debug:
+                debug = PlyLogger(sys.stderr)
+            return self.parsedebug(input, lexer, debug, tracking)
+        return self.parseopt_notrack(input, lexer)
+
+    # parsedebug().
+    #
+    # The generic parsing engine, supporting both debugging and tracking.
 
+    def parsedebug(self, input=None, lexer=None, debug=False, tracking=False):
         lookahead = None                         # Current lookahead symbol
         lookaheadstack = []                      # Stack of lookahead symbols
         actions = self.action                    # Local reference to action table (to avoid lookup on self.)
@@ -300,7 +355,8 @@ class LRParser:
         if input is not None:
             lexer.input(input)
 
-        # Set the token function
+        # Set the lexer and token function
+        self.lexer = lexer
         get_token = self.token = lexer.token
 
         # Set up the state and symbol stacks
@@ -356,11 +412,12 @@ class LRParser:
                         debug.debug('Action : Shift and goto state %s', t)
 
                     symstack.append(lookahead)
-                    lookahead = None
 
-                    # Decrease error count on successful shift
-                    if errorcount:
+                    # Decrease error count on successful shift of a token
+                    # (shifting the error symbol doesn't count)
+                    if errorcount and lookahead.type != 'error':
                         errorcount -= 1
+                    lookahead = None
                     continue
 
                 if t < 0:
@@ -523,6 +580,13 @@ class LRParser:
                             return
 
                 else:
+                    if errorcount == error_count and lookahead.type not in ('$end', 'error') \
+                       and symstack[-1].type != 'error':
+                        # Nothing was shifted since the last error, so the
+                        # recovery already tried this token; trying it again
+                        # would loop. Discard it instead, as bison does
+                        lookahead = None
+                        continue
                     errorcount = error_count
 
                 # case 1:  the statestack only has 1 entry on it.  If we're in this state, the
@@ -580,6 +644,227 @@ class LRParser:
             # If we'r here, something really bad happened
             raise RuntimeError('yacc: internal parser error!!!\n')
 
+    # parseopt_notrack().
+    #
+    # Optimized version of parsedebug() with the debugging and position tracking
+    # code removed.  Make sure changes to the parsing logic are made in both
+    # locations.
+
+    def parseopt_notrack(self, input=None, lexer=None):
+        lookahead = None                         # Current lookahead symbol
+        lookaheadstack = []                      # Stack of lookahead symbols
+        actions = self.action                    # Local reference to action table (to avoid lookup on self.)
+        goto    = self.goto                      # Local reference to goto table (to avoid lookup on self.)
+        prod    = self.productions               # Local reference to production list (to avoid lookup on self.)
+        defaulted_states = self.defaulted_states # Local reference to defaulted states
+        pslice  = YaccProduction(None)           # Production object passed to grammar rules
+        errorcount = 0                           # Used during error recovery
+
+        # If no lexer was given, we will try to use the lex module
+        if not lexer:
+            from . import lex
+            lexer = lex.lexer
+
+        # Set up the lexer and parser objects on pslice
+        pslice.lexer = lexer
+        pslice.parser = self
+
+        # If input was supplied, pass to lexer
+        if input is not None:
+            lexer.input(input)
+
+        # Set the lexer and token function
+        self.lexer = lexer
+        get_token = self.token = lexer.token
+
+        # Set up the state and symbol stacks
+        statestack = self.statestack = []   # Stack of parsing states
+        symstack = self.symstack = []       # Stack of grammar symbols
+        pslice.stack = symstack             # Put in the production
+        errtoken   = None                   # Err token
+
+        # The start state is assumed to be (0,$end)
+
+        statestack.append(0)
+        sym = YaccSymbol()
+        sym.type = '$end'
+        symstack.append(sym)
+        state = 0
+        while True:
+            if state not in defaulted_states:
+                if not lookahead:
+                    if not lookaheadstack:
+                        lookahead = get_token()     # Get the next token
+                    else:
+                        lookahead = lookaheadstack.pop()
+                    if not lookahead:
+                        lookahead = YaccSymbol()
+                        lookahead.type = '$end'
+
+                # Check the action table
+                t = actions[state].get(lookahead.type)
+            else:
+                t = defaulted_states[state]
+
+            if t is not None:
+                if t > 0:
+                    # shift a symbol on the stack
+                    statestack.append(t)
+                    state = t
+                    symstack.append(lookahead)
+
+                    # Decrease error count on successful shift of a token
+                    # (shifting the error symbol doesn't count)
+                    if errorcount and lookahead.type != 'error':
+                        errorcount -= 1
+                    lookahead = None
+                    continue
+
+                if t < 0:
+                    # reduce a symbol on the stack, emit a production
+                    p = prod[-t]
+                    pname = p.name
+                    plen  = p.len
+
+                    # Get production function
+                    sym = YaccSymbol()
+                    sym.type = pname       # Production name
+                    sym.value = None
+
+                    if plen:
+                        targ = symstack[-plen-1:]
+                        targ[0] = sym
+                        pslice.slice = targ
+
+                        try:
+                            # Call the grammar rule with our special slice object
+                            del symstack[-plen:]
+                            self.state = state
+                            p.callable(pslice)
+                            del statestack[-plen:]
+                            symstack.append(sym)
+                            state = goto[statestack[-1]][pname]
+                            statestack.append(state)
+                        except SyntaxError:
+                            # If an error was set. Enter error recovery state
+                            lookaheadstack.append(lookahead)    # Save the current lookahead token
+                            symstack.extend(targ[1:-1])         # Put the production slice back on the stack
+                            statestack.pop()                    # Pop back one state (before the reduce)
+                            state = statestack[-1]
+                            sym.type = 'error'
+                            sym.value = 'error'
+                            lookahead = sym
+                            errorcount = error_count
+                            self.errorok = False
+
+                        continue
+
+                    else:
+                        targ = [sym]
+                        pslice.slice = targ
+
+                        try:
+                            # Call the grammar rule with our special slice object
+                            self.state = state
+                            p.callable(pslice)
+                            symstack.append(sym)
+                            state = goto[statestack[-1]][pname]
+                            statestack.append(state)
+                        except SyntaxError:
+                            # If an error was set. Enter error recovery state
+                            lookaheadstack.append(lookahead)    # Save the current lookahead token
+                            statestack.pop()                    # Pop back one state (before the reduce)
+                            state = statestack[-1]
+                            sym.type = 'error'
+                            sym.value = 'error'
+                            lookahead = sym
+                            errorcount = error_count
+                            self.errorok = False
+
+                        continue
+
+                if t == 0:
+                    n = symstack[-1]
+                    return getattr(n, 'value', None)
+
+            if t is None:
+                # Error handling is identical to parsedebug(), see the
+                # comments there.
+                if errorcount == 0 or self.errorok:
+                    errorcount = error_count
+                    self.errorok = False
+                    errtoken = lookahead
+                    if errtoken.type == '$end':
+                        errtoken = None               # End of file!
+                    if self.errorfunc:
+                        if errtoken and not hasattr(errtoken, 'lexer'):
+                            errtoken.lexer = lexer
+                        self.state = state
+                        tok = self.errorfunc(errtoken)
+                        if self.errorok:
+                            lookahead = tok
+                            errtoken = None
+                            continue
+                    else:
+                        if errtoken:
+                            if hasattr(errtoken, 'lineno'):
+                                lineno = lookahead.lineno
+                            else:
+                                lineno = 0
+                            if lineno:
+                                sys.stderr.write('yacc: Syntax error at line %d, token=%s\n' % (lineno, errtoken.type))
+                            else:
+                                sys.stderr.write('yacc: Syntax error, token=%s' % errtoken.type)
+                        else:
+                            sys.stderr.write('yacc: Parse error in input. EOF\n')
+                            return
+
+                else:
+                    if errorcount == error_count and lookahead.type not in ('$end', 'error') \
+                       and symstack[-1].type != 'error':
+                        # Nothing was shifted since the last error, so the
+                        # recovery already tried this token; trying it again
+                        # would loop. Discard it instead, as bison does
+                        lookahead = None
+                        continue
+                    errorcount = error_count
+
+                if len(statestack) <= 1 and lookahead.type != '$end':
+                    lookahead = None
+                    errtoken = None
+                    state = 0
+                    del lookaheadstack[:]
+                    continue
+
+                if lookahead.type == '$end':
+                    return
+
+                if lookahead.type != 'error':
+                    sym = symstack[-1]
+                    if sym.type == 'error':
+                        lookahead = None
+                        continue
+
+                    t = YaccSymbol()
+                    t.type = 'error'
+
+                    if hasattr(lookahead, 'lineno'):
+                        t.lineno = t.endlineno = lookahead.lineno
+                    if hasattr(lookahead, 'lexpos'):
+                        t.lexpos = t.endlexpos = lookahead.lexpos
+                    t.value = lookahead
+                    lookaheadstack.append(lookahead)
+                    lookahead = t
+                else:
+                    sym = symstack.pop()
+                    statestack.pop()
+                    state = statestack[-1]
+
+                continue
+
+            # If we'r here, something really bad happened
+            raise RuntimeError('yacc: internal parser error!!!\n')
+
 # -----------------------------------------------------------------------------
 #                          === Grammar Representation ===
 #
@@ -682,6 +967,35 @@ class Production(object):
         if self.func:
             self.callable = pdict[self.func]
 
+# -----------------------------------------------------------------------------
+# class MiniProduction
+#
+# This is a stripped down version of the Production class that is used to
+# represent productions read back from a cached parse table.  It holds only the
+# information needed by the parsing engine.
+# -----------------------------------------------------------------------------
+
+class MiniProduction(object):
+    def __init__(self, str, name, len, func, file, line):
+        self.name     = name
+        self.len      = len
+        self.func     = func
+        self.callable = None
+        self.file     = file
+        self.line     = line
+        self.str      = str
+
+    def __str__(self):
+        return self.str
+
+    def __repr__(self):
+        return 'MiniProduction(%s)' % self.str
+
+    # Bind the production function name to a callable
+    def bind(self, pdict):
+        if self.func:
+            self.callable = pdict[self.func]
+
 # -----------------------------------------------------------------------------
 # class LRItem
 #
@@ -1302,13 +1616,65 @@ class LALRError(YaccError):
 
 
 # -----------------------------------------------------------------------------
-#                             == LRTable ==
+#                            == LRTable ==
+#
+# This basic class represents a basic table of LR parsing information.
+# Methods for generating the tables are not defined here.  They are defined
+# in the derived class LRGeneratedTable.
+# -----------------------------------------------------------------------------
+
+class LRTable(object):
+    def __init__(self):
+        self.lr_action = None
+        self.lr_goto = None
+        self.lr_productions = None
+
+    # Read the tables from a module created by LRGeneratedTable.write_table().
+    # Returns the signature of the grammar the tables were generated from.
+    def read_table(self, module):
+        if isinstance(module, types.ModuleType):
+            parsetab = module
+        else:
+            parsetab = importlib.import_module(module)
+
+        if getattr(parsetab, '_tabversion', None) != __tabversion__:
+            raise VersionError('yacc table file version is out of date')
+
+        self.lr_action = parsetab._lr_action
+        self.lr_goto = parsetab._lr_goto
+        self.lr_productions = [MiniProduction(*p) for p in parsetab._lr_productions]
+        return parsetab._lr_signature
+
+    # Read the tables back from a file created by LRGeneratedTable.pickle_table().
+    # Returns the signature of the grammar the tables were generated from.
+    def read_pickle(self, filename):
+        import pickle
+
+        with open(filename, 'rb') as in_f:
+            tabversion = pickle.load(in_f)
+            if tabversion != __tabversion__:
+                raise VersionError('yacc table file version is out of date')
+            signature      = pickle.load(in_f)
+            self.lr_action = pickle.load(in_f)
+            self.lr_goto   = pickle.load(in_f)
+            productions    = pickle.load(in_f)
+
+        self.lr_productions = [MiniProduction(*p) for p in productions]
+        return signature
+
+    # Bind all production function names to callable objects in pdict
+    def bind_callables(self, pdict):
+        for p in self.lr_productions:
+            p.bind(pdict)
+
+# -----------------------------------------------------------------------------
+#                             == LRGeneratedTable ==
 #
 # This class implements the LR table generation algorithm.  There are no
-# public methods.
+# public methods except for pickle_table()
 # -----------------------------------------------------------------------------
 
-class LRTable:
+class LRGeneratedTable(LRTable):
     def __init__(self, grammar, log=None):
         self.grammar = grammar
 
@@ -1340,11 +1706,6 @@ class LRTable:
         self.grammar.compute_follow()
         self.lr_parse_table()
 
-    # Bind all production function names to callable objects in pdict
-    def bind_callables(self, pdict):
-        for p in self.lr_productions:
-            p.bind(pdict)
-
     # Compute the LR(0) closure operation on I, where I is a set of LR(0) items.
 
     def lr0_closure(self, I):
@@ -1922,6 +2283,97 @@ class LRTable:
             goto[st] = st_goto
             st += 1
 
+    # -----------------------------------------------------------------------------
+    # write_table()
+    #
+    # This function writes the LR parsing tables to a file called tabmodule.py in
+    # the outputdir, so that they can be imported rather than regenerated.
+    # -----------------------------------------------------------------------------
+
+    def write_table(self, tabmodule, outputdir='', signature=''):
+        if isinstance(tabmodule, types.ModuleType):
+            raise IOError("Won't overwrite existing tabmodule")
+
+        basemodulename = tabmodule.split('.')[-1]
+        filename = os.path.join(outputdir, basemodulename) + '.py'
+
+        lines = [
+            '# %s' % os.path.basename(filename),
+            '# This file is automatically generated. Do not edit.',
+            '# pylint: disable=W,C,R',
+            '_tabversion = %r' % __tabversion__,
+            '',
+            '_lr_signature = %r' % signature,
+            '',
+            '_lr_action = {',
+        ]
+        for st, actions in self.lr_action.items():
+            lines.append('  %r: %r,' % (st, actions))
+        lines.append('}')
+        lines.append('')
+        lines.append('_lr_goto = {')
+        for st, gotos in self.lr_goto.items():
+            lines.append('  %r: %r,' % (st, gotos))
+        lines.append('}')
+        lines.append('')
+        lines.append('_lr_productions = [')
+        for p in self._production_table():
+            lines.append('  %r,' % (p,))
+        lines.append(']')
+        lines.append('')
+
+        _write_atomic(filename, '\n'.join(lines).encode('utf-8'))
+
+    # -----------------------------------------------------------------------------
+    # pickle_table()
+    #
+    # This function pickles the LR parsing tables to a supplied file object.
+    # -----------------------------------------------------------------------------
+
+    def pickle_table(self, filename, signature=''):
+        import pickle
+
+        outp = []
+        for obj in (__tabversion__, signature, self.lr_action, self.lr_goto, self._production_table()):
+            outp.append(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+        _write_atomic(filename, b''.join(outp))
+
+    # Return the productions as plain tuples that can be turned back into
+    # MiniProduction objects
+    def _production_table(self):
+        outp = []
+        for p in self.lr_productions:
+            if p.func:
+                outp.append((p.str, p.name, p.len, p.func, os.path.basename(p.file), p.line))
+            else:
+                outp.append((str(p), p.name, p.len, None, None, None))
+        return outp
+
+# -----------------------------------------------------------------------------
+# _write_atomic()
+#
+# Writes data to a temporary file next to filename and then renames it into
+# place, so that concurrent readers never observe a partially written table.
+# Python 2 has no os.replace(); os.rename() does the same on POSIX.
+# -----------------------------------------------------------------------------
+
+_replace = getattr(os, 'replace', os.rename)
+
+def _write_atomic(filename, data):
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', prefix='.parsetab-')
+    try:
+        # mkstemp() only grants access to the owner, but the tables are shared
+        os.chmod(tmpname, 0o644)
+        with os.fdopen(fd, 'wb') as outf:
+            outf.write(data)
+        _replace(tmpname, filename)
+    except BaseException:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise
+
 # -----------------------------------------------------------------------------
 #                            === INTROSPECTION ===
 #
@@ -2023,6 +2475,19 @@ class ParserReflect(object):
         self.validate_modules()
         return self.error
 
+    # Extract the grammar rules without validating anything.  This is used in
+    # optimized mode, where the checks done by validate_all() are skipped.
+    def get_grammar(self):
+        self.validate_precedence()
+        grammar = []
+        for line, module, name, doc in self.pfuncs:
+            if not doc:
+                continue
+            file = self.pdict[name].__code__.co_filename
+            for g in parse_grammar(doc, file, line):
+                grammar.append((name, g))
+        self.grammar = grammar
+
     # Compute a signature over the grammar
     def signature(self):
         parts = []
@@ -2270,7 +2735,8 @@ class ParserReflect(object):
 
 def yacc(debug=yaccdebug, module=None, start=None,
          check_recursion=True, optimize=False, debugfile=debug_file,
-         debuglog=None, errorlog=None):
+         debuglog=None, errorlog=None, picklefile=None, tabmodule=None,
+         write_tables=False, outputdir=None):
 
     # Reference to the parsing method of the last built parser
     global parse
@@ -2303,6 +2769,42 @@ def yacc(debug=yaccdebug, module=None, start=None,
     if pinfo.error:
         raise YaccError('Unable to build parser')
 
+    # Validate the parser information.  In optimized mode the grammar is
+    # trusted, which avoids reading the source of the parser module.
+    if not optimize:
+        if pinfo.validate_all():
+            raise YaccError('Unable to build parser')
+
+    # Check signature against the cached tables (if any)
+    signature = pinfo.signature()
+
+    # Try the generated table module first, then the pickled tables.  Stale
+    # tables are never used; the grammar is regenerated instead.
+    sources = []
+    if tabmodule:
+        sources.append((LRTable.read_table, tabmodule))
+    if picklefile:
+        sources.append((LRTable.read_pickle, picklefile))
+
+    for read, source in sources:
+        try:
+            lr = LRTable()
+            read_signature = read(lr, source)
+            if read_signature == signature:
+                lr.bind_callables(pinfo.pdict)
+                parser = LRParser(lr, pinfo.error_func)
+                parse = parser.parse
+                return parser
+        except VersionError as e:
+            errorlog.warning(str(e))
+        except (ImportError, IOError, OSError):
+            pass
+        except Exception as e:
+            errorlog.warning('There was a problem loading the table file: %r', e)
+
+    if optimize:
+        pinfo.get_grammar()
+
     if debuglog is None:
         if debug:
             try:
@@ -2317,10 +2819,6 @@ def yacc(debug=yaccdebug, module=None, start=None,
 
     errors = False
 
-    # Validate the parser information
-    if pinfo.validate_all():
-        raise YaccError('Unable to build parser')
-
     if not pinfo.error_func:
         errorlog.warning('no p_error() function is defined')
 
@@ -2356,82 +2854,83 @@ def yacc(debug=yaccdebug, module=None, start=None,
     if errors:
         raise YaccError('Unable to build parser')
 
-    # Verify the grammar structure
-    undefined_symbols = grammar.undefined_symbols()
-    for sym, prod in undefined_symbols:
-        errorlog.error('%s:%d: Symbol %r used, but not defined as a token or a rule', prod.file, prod.line, sym)
-        errors = True
+    if not optimize:
+        # Verify the grammar structure.  This is skipped in optimized mode.
+        undefined_symbols = grammar.undefined_symbols()
+        for sym, prod in undefined_symbols:
+            errorlog.error('%s:%d: Symbol %r used, but not defined as a token or a rule', prod.file, prod.line, sym)
+            errors = True
 
-    unused_terminals = grammar.unused_terminals()
-    if unused_terminals:
-        debuglog.info('')
-        debuglog.info('Unused terminals:')
-        debuglog.info('')
-        for term in unused_terminals:
-            errorlog.warning('Token %r defined, but not used', term)
-            debuglog.info('    %s', term)
+        unused_terminals = grammar.unused_terminals()
+        if unused_terminals:
+            debuglog.info('')
+            debuglog.info('Unused terminals:')
+            debuglog.info('')
+            for term in unused_terminals:
+                errorlog.warning('Token %r defined, but not used', term)
+                debuglog.info('    %s', term)
 
-    # Print out all productions to the debug log
-    if debug:
-        debuglog.info('')
-        debuglog.info('Grammar')
-        debuglog.info('')
-        for n, p in enumerate(grammar.Productions):
-            debuglog.info('Rule %-5d %s', n, p)
-
-    # Find unused non-terminals
-    unused_rules = grammar.unused_rules()
-    for prod in unused_rules:
-        errorlog.warning('%s:%d: Rule %r defined, but not used', prod.file, prod.line, prod.name)
-
-    if len(unused_terminals) == 1:
-        errorlog.warning('There is 1 unused token')
-    if len(unused_terminals) > 1:
-        errorlog.warning('There are %d unused tokens', len(unused_terminals))
-
-    if len(unused_rules) == 1:
-        errorlog.warning('There is 1 unused rule')
-    if len(unused_rules) > 1:
-        errorlog.warning('There are %d unused rules', len(unused_rules))
+        # Print out all productions to the debug log
+        if debug:
+            debuglog.info('')
+            debuglog.info('Grammar')
+            debuglog.info('')
+            for n, p in enumerate(grammar.Productions):
+                debuglog.info('Rule %-5d %s', n, p)
+
+        # Find unused non-terminals
+        unused_rules = grammar.unused_rules()
+        for prod in unused_rules:
+            errorlog.warning('%s:%d: Rule %r defined, but not used', prod.file, prod.line, prod.name)
+
+        if len(unused_terminals) == 1:
+            errorlog.warning('There is 1 unused token')
+        if len(unused_terminals) > 1:
+            errorlog.warning('There are %d unused tokens', len(unused_terminals))
+
+        if len(unused_rules) == 1:
+            errorlog.warning('There is 1 unused rule')
+        if len(unused_rules) > 1:
+            errorlog.warning('There are %d unused rules', len(unused_rules))
 
-    if debug:
-        debuglog.info('')
-        debuglog.info('Terminals, with rules where they appear')
-        debuglog.info('')
-        terms = list(grammar.Terminals)
-        terms.sort()
-        for term in terms:
-            debuglog.info('%-20s : %s', term, ' '.join([str(s) for s in grammar.Terminals[term]]))
-
-        debuglog.info('')
-        debuglog.info('Nonterminals, with rules where they appear')
-        debuglog.info('')
-        nonterms = list(grammar.Nonterminals)
-        nonterms.sort()
-        for nonterm in nonterms:
-            debuglog.info('%-20s : %s', nonterm, ' '.join([str(s) for s in grammar.Nonterminals[nonterm]]))
-        debuglog.info('')
-
-    if check_recursion:
-        unreachable = grammar.find_unreachable()
-        for u in unreachable:
-            errorlog.warning('Symbol %r is unreachable', u)
-
-        infinite = grammar.infinite_cycles()
-        for inf in infinite:
-            errorlog.error('Infinite recursion detected for symbol %r', inf)
+        if debug:
+            debuglog.info('')
+            debuglog.info('Terminals, with rules where they appear')
+            debuglog.info('')
+            terms = list(grammar.Terminals)
+            terms.sort()
+            for term in terms:
+                debuglog.info('%-20s : %s', term, ' '.join([str(s) for s in grammar.Terminals[term]]))
+
+            debuglog.info('')
+            debuglog.info('Nonterminals, with rules where they appear')
+            debuglog.info('')
+            nonterms = list(grammar.Nonterminals)
+            nonterms.sort()
+            for nonterm in nonterms:
+                debuglog.info('%-20s : %s', nonterm, ' '.join([str(s) for s in grammar.Nonterminals[nonterm]]))
+            debuglog.info('')
+
+        if check_recursion:
+            unreachable = grammar.find_unreachable()
+            for u in unreachable:
+                errorlog.warning('Symbol %r is unreachable', u)
+
+            infinite = grammar.infinite_cycles()
+            for inf in infinite:
+                errorlog.error('Infinite recursion detected for symbol %r', inf)
+                errors = True
+
+        unused_prec = grammar.unused_precedence()
+        for term, assoc in unused_prec:
+            errorlog.error('Precedence rule %r defined for unknown symbol %r', assoc, term)
             errors = True
 
-    unused_prec = grammar.unused_precedence()
-    for term, assoc in unused_prec:
-        errorlog.error('Precedence rule %r defined for unknown symbol %r', assoc, term)
-        errors = True
-
     if errors:
         raise YaccError('Unable to build parser')
 
-    # Run the LRTable on the grammar
-    lr = LRTable(grammar, debuglog)
+    # Run the LRGeneratedTable on the grammar
+    lr = LRGeneratedTable(grammar, debuglog)
 
     if debug:
         num_sr = len(lr.sr_conflicts)
@@ -2474,6 +2973,26 @@ def yacc(debug=yaccdebug, module=None, start=None,
                 errorlog.warning('Rule (%s) is never reduced', rejected)
                 warned_never.append(rejected)
 
+    # Write the table cache if requested
+    if picklefile:
+        try:
+            lr.pickle_table(picklefile, signature)
+        except (IOError, OSError) as e:
+            errorlog.warning("Couldn't create %r. %s" % (picklefile, e))
+
+    # Write the table module if requested
+    if tabmodule and write_tables:
+        if outputdir is None:
+            outputdir = os.path.dirname(pdict.get('__file__', ''))
+        try:
+            lr.write_table(tabmodule, outputdir, signature)
+            if tabmodule in sys.modules:
+                del sys.modules[tabmodule]
+            if hasattr(importlib, 'invalidate_caches'):
+                importlib.invalidate_caches()
+        except (IOError, OSError) as e:
+            errorlog.warning("Couldn't create %r. %s" % (tabmodule, e))
+
     # Build the parser
     lr.bind_callables(pinfo.pdict)
     parser = LRParser(lr, pinfo.error_func)
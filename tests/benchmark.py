@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+#
+# Rough performance benchmarks for the lexer and parser. These aren't run as
+# part of the test suite; run them directly to compare changes:
+#
+#     python tests/benchmark.py [name ...]
+#
+
+from __future__ import print_function
+
+import glob
+import sys
+import timeit
+from os.path import dirname, join
+
+import hcl
+from hcl.lexer import Lexer
+
+FIXTURE_DIR = join(dirname(__file__), 'fixtures')
+
+BENCHMARKS = []
+
+
+def benchmark(fn):
+    BENCHMARKS.append(fn)
+    return fn
+
+
+def run(name, fn, number):
+    # best of several runs, to reduce noise
+    best = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print('%-40s %10.3f ms' % (name, best * 1000))
+    return best
+
+
+@benchmark
+def long_string():
+    for size in (10000, 100000, 1000000):
+        s = 'policy = "%s"' % ('x' * size)
+        run('long_string %d' % size, lambda: hcl.loads(s), 3)
+
+
+@benchmark
+def escaped_string():
+    # embedded JSON is full of escaped quotes
+    for size in (10000, 100000, 1000000):
+        s = 'policy = "%s"' % ('{\\"k\\": \\"v\\"}' * (size // 16))
+        run('escaped_string %d' % size, lambda: hcl.loads(s), 3)
+
+
+@benchmark
+def interpolation():
+    expr = '"${lookup(var.amis, element(var.regions, count.index))}"'
+    for count in (100, 1000, 10000):
+        s = 'values = [%s]' % ', '.join([expr] * count)
+        run('interpolation %d' % count, lambda: hcl.loads(s), 3)
+
+
+@benchmark
+def heredoc():
+    line = '  echo "configuring instance ${count.index}" >> /var/log/init.log\n'
+    for lines in (100, 1000, 10000):
+        s = 'user_data = <<EOF\n%sEOF\n' % (line * lines)
+        run('heredoc %d lines' % lines, lambda: hcl.loads(s), 3)
+        s = 'user_data = <<-EOF\n%s\tEOF\n' % (('\t' + line) * lines)
+        run('tabbed heredoc %d lines' % lines, lambda: hcl.loads(s), 3)
+
+
+@benchmark
+def large_list():
+    for count in (10000, 100000):
+        s = 'cidrs = [%s]' % ', '.join(
+            '"10.%d.%d.0/24"' % (i // 256 % 256, i % 256) for i in range(count)
+        )
+        run('large_list %d' % count, lambda: hcl.loads(s), 1)
+
+
+@benchmark
+def large_object():
+    for count in (10000, 100000):
+        s = 'tags {\n%s}\n' % ''.join('key%d = "value"\n' % i for i in range(count))
+        run('large_object %d' % count, lambda: hcl.loads(s), 1)
+
+
+@benchmark
+def repeated_blocks():
+    block = 'resource "aws_instance" "web%d" {\n  ami = "ami-123"\n  count = 2\n}\n'
+    for count in (1000, 10000):
+        s = ''.join(block % i for i in range(count))
+        run('repeated_blocks %d' % count, lambda: hcl.loads(s), 1)
+        d = hcl.loads(s)
+        flatten = hcl.parser.get_parser().objectlist_flat
+        items = [
+            ('resource', {'aws_instance': {k: v}})
+            for k, v in sorted(d['resource']['aws_instance'].items())
+        ]
+        run(
+            'repeated_blocks %d (merge only)' % count,
+            lambda: flatten(items, True),
+            3,
+        )
+
+
+@benchmark
+def errors():
+    # invalid documents, as seen by a linter
+    docs = ['a = ', 'a = [1,', 'a {', '}', 'a = {b = }', 'a.b = 1 = 2']
+
+    def parse_all():
+        for s in docs:
+            try:
+                hcl.loads(s)
+            except ValueError:
+                pass
+
+    run('errors (%d documents)' % len(docs), parse_all, 1000)
+
+
+@benchmark
+def detection():
+    # deciding between HCL and JSON, with a large amount of leading whitespace
+    for size in (10000, 1000000):
+        pad = ' \n' * (size // 2)
+        s = pad + '{"a": 1}'
+        run('detection json str %d' % size, lambda: hcl.loads(s), 3)
+        b = s.encode('utf-8')
+        run('detection json bytes %d' % size, lambda: hcl.loads(b), 3)
+        s = pad + 'a = 1'
+        run('detection hcl str %d' % size, lambda: hcl.api.isHcl(s), 3)
+
+
+@benchmark
+def many():
+    # lots of small documents, one at a time and as a batch
+    docs = [
+        'variable "region%d" {\n  default = "us-east-1"\n}\n' % i for i in range(2000)
+    ]
+
+    def one_at_a_time():
+        return [hcl.loads(s) for s in docs]
+
+    run('many loads (%d documents)' % len(docs), one_at_a_time, 3)
+    run(
+        'many loads_many (%d documents)' % len(docs),
+        lambda: list(hcl.loads_many(docs)),
+        3,
+    )
+
+
+@benchmark
+def cache():
+    # the same few documents loaded over and over
+    with open(join(FIXTURE_DIR, 'terraform_heroku.hcl')) as fp:
+        heroku = fp.read()
+    with open(join(FIXTURE_DIR, 'structure_list_deep.hcl')) as fp:
+        deep = fp.read()
+    docs = [heroku, deep] * 500
+
+    def load_all():
+        for s in docs:
+            hcl.loads(s)
+
+    run('cache disabled (%d loads)' % len(docs), load_all, 3)
+    hcl.api.enable_cache()
+    try:
+        run('cache enabled (%d loads)' % len(docs), load_all, 3)
+        print(hcl.api.cache_info())
+    finally:
+        hcl.api.disable_cache()
+
+
+@benchmark
+def disk_cache():
+    # loading every fixture by path, as hcltool would over a repository
+    import shutil
+    import tempfile
+
+    fnames = sorted(glob.glob(join(FIXTURE_DIR, '*.hcl')))
+    paths = []
+    for fname in fnames:
+        try:
+            hcl.load(fname)
+        except ValueError:
+            continue
+        paths.append(fname)
+
+    def load_all():
+        for path in paths:
+            hcl.load(path)
+
+    run('disk cache disabled (%d files)' % len(paths), load_all, 20)
+    directory = tempfile.mkdtemp()
+    try:
+        hcl.api.enable_disk_cache(directory)
+        load_all()
+        run('disk cache enabled (%d files)' % len(paths), load_all, 20)
+    finally:
+        hcl.api.disable_disk_cache()
+        shutil.rmtree(directory)
+
+
+@benchmark
+def load_dir():
+    # a tree of copies of the fixtures, loaded serially and in parallel
+    import os
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    try:
+        fnames = sorted(glob.glob(join(FIXTURE_DIR, '*.hcl')))
+        for i in range(20):
+            subdir = join(directory, str(i))
+            os.mkdir(subdir)
+            for fname in fnames:
+                shutil.copy(fname, subdir)
+        count = len(hcl.load_dir(directory, workers=1))
+
+        for workers in (1, 2, 4):
+            run(
+                'load_dir %d files, %d workers' % (count, workers),
+                lambda: hcl.load_dir(directory, workers=workers),
+                3,
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+@benchmark
+def reductions():
+    # grammar actions invoked per second while parsing a large document
+    block = (
+        'resource "aws_instance" "web%d" {\n  ami = "ami-123"\n  tags = ["a", "b"]\n}\n'
+    )
+    s = ''.join(block % i for i in range(5000))
+
+    parser = hcl.parser.get_parser()
+    parser.parse(s)
+    prods = parser.yacc.productions
+    actions = [p.callable for p in prods]
+    count = [0]
+
+    def counted(action):
+        def wrapper(p):
+            count[0] += 1
+            action(p)
+
+        return wrapper
+
+    for p in prods:
+        if p.callable:
+            p.callable = counted(p.callable)
+    parser.parse(s)
+    for p, action in zip(prods, actions):
+        p.callable = action
+
+    best = run('reductions (%d per parse)' % count[0], lambda: parser.parse(s), 3)
+    print('%-40s %10.0f /s' % ('reductions', count[0] / best))
+
+
+@benchmark
+def fixtures():
+    # the generic LR loop against the specialized one, over the test fixtures
+    docs = []
+    for fname in sorted(glob.glob(join(FIXTURE_DIR, '*.hcl'))):
+        with open(fname) as fp:
+            docs.append(fp.read())
+
+    yacc = hcl.parser.get_parser().yacc
+
+    def parse_all(parse):
+        for s in docs:
+            try:
+                parse(s, lexer=Lexer())
+            except ValueError:
+                pass
+
+    run('fixtures (parsedebug)', lambda: parse_all(yacc.parsedebug), 100)
+    run('fixtures (parseopt_notrack)', lambda: parse_all(yacc.parse), 100)
+
+
+@benchmark
+def memory():
+    # peak traced memory while lexing/parsing a multi-MB document
+    import tracemalloc
+
+    block = (
+        'resource "aws_instance" "web%d" {\n  ami = "ami-123"\n  tags = ["a", "b"]\n}\n'
+    )
+    s = ''.join(block % i for i in range(30000))
+    hcl.loads('')  # build the parser outside of the measurement
+
+    def lex_all():
+        lexer = Lexer()
+        lexer.input(s)
+        return list(iter(lexer.token, None))
+
+    for name, fn in (('tokens', lex_all), ('loads', lambda: hcl.loads(s))):
+        label = 'memory %s (%.1f MB input)' % (name, len(s) / 1e6)
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-40s %10.1f MB peak' % (label, peak / 1e6))
+        run(label, fn, 1)
+
+
+@benchmark
+def load_file():
+    # peak traced memory of reading a large file and of hcl.load; the file is
+    # mostly one heredoc so that the parse itself is cheap
+    import os
+    import tempfile
+    import tracemalloc
+
+    from hcl.api import _read
+
+    line = '  echo "configuring instance ${count.index}" >> /var/log/init.log\n'
+    fd, fname = tempfile.mkstemp(suffix='.hcl')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write('user_data = <<EOF\n%sEOF\n' % (line * 300000))
+        size = os.path.getsize(fname)
+
+        def read_decode():
+            with open(fname, 'rb') as fp:
+                return fp.read().decode('utf-8')
+
+        def read_mapped():
+            with open(fname, 'rb') as fp:
+                return _read(fp)
+
+        def read_loads():
+            with open(fname, 'rb') as fp:
+                return hcl.loads(fp.read())
+
+        for name, fn in (
+            ('read + decode', read_decode),
+            ('mmap + decode', read_mapped),
+            ('read + loads', read_loads),
+            ('load', lambda: hcl.load(fname)),
+        ):
+            label = 'load_file %s (%.1f MB)' % (name, size / 1e6)
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('%-40s %10.1f MB peak' % (label, peak / 1e6))
+            run(label, fn, 3)
+    finally:
+        os.unlink(fname)
+
+
+def main():
+    names = sys.argv[1:]
+    for fn in BENCHMARKS:
+        if not names or fn.__name__ in names:
+            fn()
+
+
+if __name__ == '__main__':
+    main()
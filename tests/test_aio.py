@@ -0,0 +1,104 @@
+import sys
+import threading
+
+import pytest
+
+import hcl
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 7), reason="needs asyncio.run"
+)
+
+if sys.version_info >= (3, 7):
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    import hcl.aio
+
+
+@pytest.fixture
+def configure():
+    max_concurrency = hcl.aio._max_concurrency
+    yield hcl.aio.configure
+    hcl.aio.configure(executor=None, max_concurrency=max_concurrency)
+
+
+def test_aloads():
+    assert asyncio.run(hcl.aloads('a = 1')) == {'a': 1}
+    assert asyncio.run(hcl.aloads(b'{"b": 2}')) == {'b': 2}
+    with pytest.raises(ValueError):
+        asyncio.run(hcl.aloads('a = '))
+
+
+def test_aload(tmp_path, configure):
+    path = tmp_path / 'a.hcl'
+    path.write_bytes(b'a = 1\n# comment\n')
+
+    with ProcessPoolExecutor(1) as executor:
+        configure(executor=executor)
+        assert asyncio.run(hcl.aload(str(path))) == {'a': 1}
+        assert asyncio.run(hcl.aload(str(path), export_comments='LINE')) == {
+            'a': 1, 'comment-L002': 'comment'
+        }
+
+    # an executor passed in is used instead of the configured one
+    with ThreadPoolExecutor(1) as executor:
+        with open(str(path), 'rb') as fp:
+            assert asyncio.run(hcl.aload(fp, executor=executor)) == {'a': 1}
+
+
+def test_aload_many(tmp_path):
+    paths = []
+    for i in range(10):
+        path = tmp_path / ('%d.hcl' % i)
+        path.write_bytes(b'a = %d' % i if i != 5 else b'a = ')
+        paths.append(str(path))
+    paths.append(str(tmp_path / 'missing.hcl'))
+
+    async def load_all():
+        return [r async for r in hcl.aload_many(paths)]
+
+    results = dict(asyncio.run(load_all()))
+    assert sorted(results) == sorted(paths)
+    for i, path in enumerate(paths[:10]):
+        if i == 5:
+            assert isinstance(results[path], ValueError)
+        else:
+            assert results[path] == {'a': i}
+    assert isinstance(results[paths[-1]], (IOError, OSError))
+
+
+def test_concurrency_and_cancel(configure, monkeypatch):
+    # parses block until released, to see how many run at once
+    release = threading.Event()
+    lock = threading.Lock()
+    running = []
+    loads = hcl.api.loads
+
+    def blocking_loads(s, export_comments=None):
+        with lock:
+            running.append(s)
+        release.wait(5)
+        return loads(s, export_comments)
+
+    monkeypatch.setattr(hcl.api, 'loads', blocking_loads)
+    configure(max_concurrency=2)
+
+    async def run():
+        tasks = [asyncio.ensure_future(hcl.aloads('a = %d' % i)) for i in range(5)]
+        while len(running) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        assert len(running) == 2
+
+        # documents still waiting for the semaphore are never parsed
+        for task in tasks[1:]:
+            task.cancel()
+        release.set()
+        assert await tasks[0] == {'a': 0}
+        for task in tasks[1:]:
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(run())
+    assert len(running) == 2
@@ -549,3 +549,89 @@ def test_complex_tokens(tokens, input_string):
         print(lex_tok)
 
     assert lexer.token() is None
+
+
+def test_lexer_is_cloned():
+    a = hcl.lexer.Lexer()
+    b = hcl.lexer.Lexer()
+    assert a.lex is not b.lex
+    assert a.lex.lexstatere is b.lex.lexstatere
+
+    c = hcl.lexer.Lexer(export_comments='ALL')
+    assert c.lex.lexstatere is not a.lex.lexstatere
+
+    a.input('a = "foo"\nb = 1')
+    b.input('c = <<EOF\nbar\nEOF')
+    assert [t.value for t in b.lex] == ['c', '=', 'bar']
+    assert [t.value for t in a.lex] == ['a', '=', 'foo', 'b', '=', 1]
+
+
+STRING_VALUE_FIXTURES = [
+    ('"' + f100 * 100 + '"', f100 * 100),
+    (r'"a\"b"', 'a"b'),
+    (r'"a\\b"', 'a\\b'),
+    (r'"a\nb"', 'a\\nb'),
+    ('"${file("foo")} {bar} $baz"', '${file("foo")} {bar} $baz'),
+    ('"${merge({a = "b"}, {})}"', '${merge({a = "b"}, {})}'),
+    ('"${' + f100 + '}\n${' + f100 + '}"', '${' + f100 + '}\n${' + f100 + '}'),
+    ('"a\nb\nc"', 'a\nb\nc'),
+    ('<<EOF\nhello\n  world\nEOF', 'hello\n  world'),
+    ('<<EOF\r\nhello\r\nEOF', 'hello'),
+    ('<<EOF\nhello EOF', 'hello '),
+    ('<<-EOF\n\thello\n\t\tworld\n\tEOF', 'hello\nworld'),
+    ('<<-EOF\r\n\thello\r\n\tEOF  ', 'hello'),
+]
+
+@pytest.mark.parametrize("input_string,value", STRING_VALUE_FIXTURES)
+def test_string_values(input_string, value):
+
+    lexer = hcl.lexer.Lexer()
+    lexer.input(input_string + '\nfoo')
+
+    lex_tok = lexer.token()
+    assert lex_tok.type == 'STRING'
+    assert lex_tok.value == value
+
+    lex_tok = lexer.token()
+    assert lex_tok.value == 'foo'
+    assert lex_tok.lineno == input_string.count('\n') + 2
+
+
+def test_lexer_token_slots():
+    lexer = hcl.lexer.Lexer()
+    lexer.input('a = "foo"')
+    token = lexer.token()
+    assert not hasattr(token, '__dict__')
+    assert (token.type, token.value, token.lineno, token.lexpos) == ('IDENTIFIER', 'a', 1, 0)
+
+
+def test_lexer_master_not_kept():
+    # the shared master lexer mustn't keep the Lexer that first needed it
+    import gc
+    import weakref
+
+    class SubLexer(hcl.lexer.Lexer):
+        pass
+
+    errors = []
+    lexer = SubLexer(errors=errors)
+    lexer.input('a = ~')
+    while lexer.token():
+        pass
+    assert len(errors) == 1
+
+    ref = weakref.ref(lexer)
+    errors_ref = weakref.ref(errors[0])
+    del lexer, errors
+    gc.collect()
+    assert ref() is None
+    assert errors_ref() is None
+
+    # later Lexers still work, and get their own errors
+    errors = []
+    lexer = SubLexer(errors=errors)
+    lexer.input('b = ~')
+    assert lexer.token().value == 'b'
+    while lexer.token():
+        pass
+    assert len(errors) == 1
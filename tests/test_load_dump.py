@@ -5,6 +5,7 @@
 from __future__ import print_function
 
 from os.path import join, dirname
+import os
 import hcl
 import json
 
@@ -98,3 +99,426 @@ def test_parser_str(hcl_fname, invalid, export_comments):
         else:
             with pytest.raises(ValueError):
                 hcl.loads(input, export_comments)
+
+
+@pytest.fixture(params=['read', 'mmap'])
+def read_mode(request, monkeypatch):
+    # small files are only memory mapped when the threshold is lowered
+    if request.param == 'mmap':
+        monkeypatch.setattr(hcl.api, 'mmap_threshold', 0)
+    return request.param
+
+
+@pytest.mark.parametrize("hcl_fname,invalid", PARSE_FIXTURES)
+def test_load(hcl_fname, invalid, read_mode):
+    fname = join(PARSE_FIXTURE_DIR, hcl_fname)
+    with open(fname, 'rb') as fp:
+        expected = hcl.loads(fp.read())
+
+    assert hcl.load(fname) == expected
+    for mode in ('rb', 'r'):
+        with open(fname, mode) as fp:
+            assert hcl.load(fp) == expected
+            assert not fp.read()
+
+
+def test_load_gzip(tmp_path, read_mode):
+    # wrapped streams are read, even though they have a fileno()
+    import gzip
+
+    fname = str(tmp_path / 'test.hcl.gz')
+    with gzip.open(fname, 'wb') as fp:
+        fp.write(u'a = "é"\n'.encode('utf-8'))
+
+    with gzip.open(fname) as fp:
+        assert hcl.load(fp) == {'a': u'é'}
+
+
+def test_load_mapped(tmp_path, read_mode, monkeypatch):
+    # only plain binary files are memory mapped, and only large ones unless
+    # the threshold is lowered
+    import mmap
+
+    mapped = []
+    real_mmap = mmap.mmap
+
+    def spy(fileno, *args, **kwargs):
+        mapped.append(fileno)
+        return real_mmap(fileno, *args, **kwargs)
+
+    monkeypatch.setattr(hcl.api.mmap, 'mmap', spy)
+
+    fname = tmp_path / 'test.hcl'
+    fname.write_bytes(b'a = 1')
+    for mode, buffering in (('rb', -1), ('rb', 0), ('r', -1)):
+        del mapped[:]
+        with open(str(fname), mode, buffering) as fp:
+            assert hcl.load(fp) == {'a': 1}
+            if read_mode == 'mmap' and 'b' in mode:
+                assert mapped == [fp.fileno()]
+            else:
+                assert mapped == []
+
+
+def test_load_partially_read(tmp_path, read_mode):
+    fname = tmp_path / 'test.hcl'
+    fname.write_bytes(u'# été\na = "é"\n'.encode('utf-8'))
+
+    with open(str(fname), 'rb') as fp:
+        fp.readline()
+        assert hcl.load(fp) == {'a': u'é'}
+
+
+def test_load_empty(tmp_path, read_mode):
+    fname = tmp_path / 'empty.hcl'
+    fname.write_bytes(b'')
+    assert hcl.load(str(fname)) == {}
+    assert hcl.load(fname) == {}
+
+
+def test_load_json(tmp_path, read_mode):
+    fname = tmp_path / 'test.json'
+    fname.write_bytes(b'  {"a": [1, 2]}')
+    assert hcl.load(str(fname)) == {'a': [1, 2]}
+
+
+def test_load_error_position(tmp_path, read_mode):
+    # positions are counted in characters, not bytes
+    fname = tmp_path / 'test.hcl'
+    fname.write_bytes(u'a = "éé"\nb = }\n'.encode('utf-8'))
+
+    with pytest.raises(hcl.HclSyntaxError) as e:
+        hcl.load(str(fname))
+    assert (e.value.line, e.value.column, e.value.offset) == (2, 4, 13)
+
+
+IS_HCL_FIXTURES = [
+    (u'', True),
+    (u'a = 1', True),
+    (u'{"a": 1}', False),
+    (u' \t\r\n{"a": 1}', False),
+    (u'\x1c\x0b\x0c{}', False),
+    (u'　\xa0 {}', False),
+    (u'　a = 1', True),
+    (u'é = 1', True),
+    (u'  # comment\n{}', True),
+    (u' \n\t', None),
+    (u'　', None),
+]
+
+
+@pytest.mark.parametrize("s,expected", IS_HCL_FIXTURES)
+def test_isHcl(s, expected):
+    for value in (s, s.encode('utf-8')):
+        if expected is None:
+            with pytest.raises(ValueError):
+                hcl.api.isHcl(value)
+        else:
+            assert hcl.api.isHcl(value) is expected
+
+
+def test_loads_json_bytes():
+    s = u'\n\n{"a": "é", "b": [1, 2]}'
+    assert hcl.loads(s.encode('utf-8')) == {'a': u'é', 'b': [1, 2]}
+    assert hcl.loads(s) == {'a': u'é', 'b': [1, 2]}
+
+
+MANY_FIXTURES = [
+    u'a = 1',
+    u'a = "unterminated',
+    b'b = "bytes"',
+    u'{"c": [1, 2]}',
+    u'd = <<EOF\nx\n',
+    u'e {\n  f = "g"\n}\n',
+    u'',
+    u'h = = 1',
+    u'i = "${j}"\nk = 2',
+]
+
+
+def _result(fn, *args):
+    try:
+        return fn(*args)
+    except ValueError as e:
+        return (type(e), str(e))
+
+
+def test_loads_many():
+    results = list(hcl.loads_many(iter(MANY_FIXTURES)))
+    assert len(results) == len(MANY_FIXTURES)
+    for s, result in zip(MANY_FIXTURES, results):
+        if isinstance(result, ValueError):
+            result = (type(result), str(result))
+        assert result == _result(hcl.loads, s)
+
+
+def test_load_many(tmp_path):
+    paths = []
+    for i, s in enumerate(MANY_FIXTURES):
+        path = tmp_path / ('%d.hcl' % i)
+        path.write_bytes(s if isinstance(s, bytes) else s.encode('utf-8'))
+        paths.append(str(path))
+
+    missing = str(tmp_path / 'missing.hcl')
+    with open(paths[0], 'rb') as fp:
+        results = list(hcl.load_many(paths + [missing, fp]))
+
+    assert len(results) == len(paths) + 2
+    for path, result in zip(paths, results):
+        if isinstance(result, ValueError):
+            result = (type(result), str(result))
+        assert result == _result(hcl.load, path)
+
+    assert isinstance(results[-2], (IOError, OSError))
+    assert results[-1] == {'a': 1}
+
+
+@pytest.fixture
+def cache():
+    hcl.api.enable_cache(max_entries=3, max_size=200)
+    yield
+    hcl.api.disable_cache()
+
+
+def test_cache(cache):
+    s = 'a = [1, 2]\n# comment\n'
+    assert hcl.loads(s) == {'a': [1, 2]}
+    assert hcl.api.cache_info()[:4] == (0, 1, 0, 1)
+
+    # hits return copies that can be modified freely
+    result = hcl.loads(s)
+    assert result == {'a': [1, 2]}
+    result['a'].append(3)
+    assert hcl.loads(s) == {'a': [1, 2]}
+    assert hcl.api.cache_info()[:4] == (2, 1, 0, 1)
+
+    # export_comments is part of the key
+    assert hcl.loads(s, export_comments='LINE') == {
+        'a': [1, 2], 'comment-L002': 'comment'
+    }
+    assert hcl.api.cache_info()[:4] == (2, 2, 0, 2)
+
+    # errors aren't cached
+    for i in range(2):
+        with pytest.raises(ValueError):
+            hcl.loads('a = ')
+    assert hcl.api.cache_info()[:4] == (2, 4, 0, 2)
+
+
+def test_cache_eviction(cache):
+    for i in range(4):
+        hcl.loads('a = %d' % i)
+    info = hcl.api.cache_info()
+    assert (info.misses, info.evictions, info.entries) == (4, 1, 3)
+
+    # the least recently used entry was evicted
+    hcl.loads('a = 1')
+    hcl.loads('a = 0')
+    info = hcl.api.cache_info()
+    assert (info.hits, info.misses, info.evictions) == (1, 5, 2)
+
+    # documents are also evicted to keep to the maximum size, and a document
+    # too large for the cache isn't stored at all
+    hcl.loads('a = "%s"' % ('x' * 80))
+    info = hcl.api.cache_info()
+    assert (info.evictions, info.entries) == (4, 2)
+    assert info.size <= 200
+    hcl.loads('a = "%s"' % ('x' * 200))
+    assert hcl.api.cache_info()[2:] == info[2:]
+
+
+def test_cache_best_effort(cache):
+    # too deeply nested to marshal, so it isn't cached
+    s = 'a {' * 2100 + '}' * 2100
+    for i in range(2):
+        assert list(hcl.loads(s)) == ['a']
+    assert hcl.api.cache_info()[:4] == (0, 2, 0, 0)
+
+    # None is a result that can be cached, not a miss
+    key = ('null', None)
+    hcl.api._cache.put(key, None)
+    assert hcl.api._cache.get(key) is None
+    assert hcl.api.cache_info()[:4] == (1, 2, 0, 1)
+
+
+def test_cache_disabled():
+    assert hcl.api.cache_info() is None
+    assert hcl.loads('a = 1') == {'a': 1}
+
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    directory = str(tmp_path / 'cache')
+    hcl.api.enable_disk_cache(directory, max_size=1000)
+    yield directory
+    hcl.api.disable_disk_cache()
+
+
+def _no_parse(monkeypatch):
+    def _loads(*args):
+        raise AssertionError('file was parsed')
+
+    monkeypatch.setattr(hcl.api, '_loads', _loads)
+
+
+def test_disk_cache(tmp_path, disk_cache, monkeypatch):
+    path = tmp_path / 'a.hcl'
+    path.write_bytes(b'a = [1, 2]\n# comment\n')
+    path = str(path)
+    assert hcl.load(path) == {'a': [1, 2]}
+    assert hcl.load(path, export_comments='LINE') == {
+        'a': [1, 2], 'comment-L002': 'comment'
+    }
+    assert len(os.listdir(disk_cache)) == 2
+
+    with monkeypatch.context() as m:
+        _no_parse(m)
+        assert hcl.load(path) == {'a': [1, 2]}
+        assert list(hcl.load_many([path])) == [{'a': [1, 2]}]
+        assert hcl.load(path, export_comments='LINE') == {
+            'a': [1, 2], 'comment-L002': 'comment'
+        }
+
+    # changing the file replaces its entry
+    with open(path, 'wb') as fp:
+        fp.write(b'a = 3')
+    os.utime(path, (0, 0))
+    assert hcl.load(path) == {'a': 3}
+    assert len(os.listdir(disk_cache)) == 2
+
+    # corrupt entries are parsed again
+    for name in os.listdir(disk_cache):
+        with open(os.path.join(disk_cache, name), 'wb') as fp:
+            fp.write(b'\xff')
+    assert hcl.load(path) == {'a': 3}
+    with monkeypatch.context() as m:
+        _no_parse(m)
+        assert hcl.load(path) == {'a': 3}
+
+
+def test_disk_cache_code_version(tmp_path, disk_cache, monkeypatch):
+    # entries written by other versions of the parser aren't used
+    path = tmp_path / 'a.hcl'
+    path.write_bytes(b'a = 1')
+    path = str(path)
+    assert hcl.load(path) == {'a': 1}
+
+    version = hcl.api._code_version()
+    assert version[1] == hcl.api._code_version()[1]
+
+    with monkeypatch.context() as m:
+        m.setattr(hcl.api, '_code_version', lambda: (version[0], 'changed'))
+        hcl.api.enable_disk_cache(disk_cache, max_size=1000)
+        loads = hcl.api._loads
+        parsed = []
+
+        def _loads(*args):
+            parsed.append(args[0])
+            return loads(*args)
+
+        m.setattr(hcl.api, '_loads', _loads)
+        assert hcl.load(path) == {'a': 1}
+        assert hcl.load(path) == {'a': 1}
+        assert len(parsed) == 1
+
+
+def test_disk_cache_best_effort(tmp_path, disk_cache):
+    # too deeply nested to marshal, so it isn't cached
+    path = tmp_path / 'deep.hcl'
+    path.write_bytes(b'a {' * 2100 + b'}' * 2100)
+    path = str(path)
+    assert list(hcl.load(path)) == ['a']
+    assert os.listdir(disk_cache) == []
+
+    # None is a result that can be cached, not a miss
+    cache = hcl.api._disk_cache
+    key = cache.key(path, os.stat(path), None)
+    assert cache.get(key) is hcl.api._missing
+    cache.put(key, None)
+    assert cache.get(key) is None
+
+
+def test_disk_cache_unavailable(tmp_path, disk_cache, monkeypatch):
+    # a cache directory that goes away or can't be listed only stops caching
+    import shutil
+
+    path = tmp_path / 'a.hcl'
+    path.write_bytes(b'a = 1')
+    path = str(path)
+
+    def fail(*args):
+        raise OSError('listdir failed')
+
+    with monkeypatch.context() as m:
+        # as if the cache were full, so that writing an entry evicts
+        m.setattr(hcl.api._disk_cache, 'size', hcl.api._disk_cache.max_size)
+        m.setattr(hcl.api.os, 'listdir', fail)
+        assert hcl.load(path) == {'a': 1}
+
+    shutil.rmtree(disk_cache)
+    assert hcl.load(path) == {'a': 1}
+    assert list(hcl.load_many([path])) == [{'a': 1}]
+    assert not os.path.exists(disk_cache)
+
+
+def test_disk_cache_eviction(tmp_path, disk_cache):
+    paths = []
+    for i in range(10):
+        path = tmp_path / ('%d.hcl' % i)
+        path.write_bytes(('a = "%s"' % ('x' * 200)).encode('utf-8'))
+        paths.append(str(path))
+        hcl.load(paths[-1])
+
+    sizes = [
+        os.path.getsize(os.path.join(disk_cache, name))
+        for name in os.listdir(disk_cache)
+    ]
+    assert 0 < len(sizes) < 10
+    assert sum(sizes) <= 1000
+
+    # too large to be cached
+    with open(paths[0], 'wb') as fp:
+        fp.write(('a = "%s"' % ('x' * 1000)).encode('utf-8'))
+    os.utime(paths[0], (0, 0))
+    assert hcl.load(paths[0]) == {'a': 'x' * 1000}
+    assert sum(
+        os.path.getsize(os.path.join(disk_cache, name))
+        for name in os.listdir(disk_cache)
+    ) <= 1000
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_load_dir(tmp_path, workers):
+    expected = {}
+    for i, s in enumerate(MANY_FIXTURES):
+        directory = tmp_path / ('d%d' % (i % 3))
+        if not directory.exists():
+            directory.mkdir()
+        path = directory / ('%d.hcl' % i)
+        path.write_bytes(s if isinstance(s, bytes) else s.encode('utf-8'))
+        expected[str(path)] = _result(hcl.load, str(path))
+    (tmp_path / 'd0' / 'other.json').write_bytes(b'{}')
+
+    results = hcl.load_dir(str(tmp_path), workers=workers)
+    assert list(results) == sorted(expected)
+    for path, result in results.items():
+        if isinstance(result, ValueError):
+            result = (type(result), str(result))
+        assert result == expected[path]
+
+    assert list(hcl.load_dir(str(tmp_path), pattern='*.json')) == [
+        str(tmp_path / 'd0' / 'other.json')
+    ]
+
+
+def test_load_dir_missing(tmp_path):
+    # unlike an empty directory, a bad path is an error
+    assert hcl.load_dir(str(tmp_path)) == {}
+
+    with pytest.raises(OSError):
+        hcl.load_dir(str(tmp_path / 'missing'))
+
+    path = tmp_path / 'a.hcl'
+    path.write_bytes(b'a = 1')
+    with pytest.raises(OSError):
+        hcl.load_dir(str(path))
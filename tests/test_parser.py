@@ -5,8 +5,10 @@
 from __future__ import print_function
 
 from os.path import join, dirname
+import sys
 import hcl
 import json
+import pickle
 
 import pytest
 
@@ -99,3 +101,321 @@ def test_parser_str(hcl_fname, invalid, export_comments):
         else:
             with pytest.raises(ValueError):
                 hcl.loads(input, export_comments)
+
+
+@pytest.mark.parametrize("hcl_fname,invalid", PARSE_FIXTURES)
+def test_parser_fast_loop(hcl_fname, invalid):
+    # the specialized parse loop must agree with the generic one
+    from hcl.lexer import Lexer
+
+    with open(join(PARSE_FIXTURE_DIR, hcl_fname), 'r') as fp:
+        input = fp.read()
+
+    yacc = hcl.parser.get_parser().yacc
+    results = []
+    for parse in (yacc.parse, yacc.parsedebug):
+        try:
+            results.append(parse(input, lexer=Lexer()))
+        except ValueError as e:
+            results.append(str(e))
+
+    assert results[0] == results[1]
+
+
+def test_parser_error_expected():
+    with pytest.raises(ValueError) as e:
+        hcl.loads('a = 1 = 2')
+    assert str(e.value) == (
+        "Line 1, column 6, index 6: unexpected EQUAL; expected "
+        "COMMA, IDENTIFIER, STRING, COMMENT, MULTICOMMENT, MINUS, NUMBER, "
+        "FLOAT, $end, RIGHTBRACE, ADD, MULTIPLY, DIVIDE, EQ, NE, LT, GT, LE, GE"
+    )
+
+    parser = hcl.parser.get_parser().yacc
+    assert parser.expected_tokens(0) == tuple(
+        t for t in parser.action[0] if t != 'error'
+    )
+
+
+ERROR_POSITION_FIXTURES = [
+    ('a = 1\nb = 2 = 3', 'unexpected EQUAL', 2, 6, 12),
+    ('a = 1\n\n  b = }', 'unexpected RIGHTBRACE', 3, 6, 13),
+    ('a = [\n  1,\n', 'unexpected end of file', 3, 0, 11),
+    ('a = "x\ny" b = ]', 'unexpected RIGHTBRACKET', 2, 7, 14),
+    ('a = <<EOF\nx\nEOF\nb = )', 'unexpected RIGHTPAREN', 4, 4, 20),
+    ('/* a\n */ a = 1\n\tb ^', "Illegal character '^'", 3, 3, 18),
+    ('a = "x\n\ny', 'EOF before closing string quote', 3, 1, 9),
+    # strings and heredocs are reported where they start
+    ('a = [1 "foo"]', 'unexpected STRING', 1, 7, 7),
+    ('a = 1\nb = [1\n  "x\ny"]', 'unexpected STRING', 3, 2, 15),
+    ('a = [1 <<EOF\nx\nEOF\n]', 'unexpected STRING', 1, 7, 7),
+    ('a = [1\n  <<-EOF\n  x\n  EOF\n]', 'unexpected STRING', 2, 2, 9),
+]
+
+
+@pytest.mark.parametrize("hcl_string,msg,line,column,offset", ERROR_POSITION_FIXTURES)
+def test_parser_error_position(hcl_string, msg, line, column, offset):
+    with pytest.raises(hcl.HclSyntaxError) as e:
+        hcl.loads(hcl_string)
+    error = e.value
+    assert (error.msg, error.line, error.column, error.offset) == (
+        msg, line, column, offset
+    )
+    assert str(error).startswith(
+        "Line %d, column %d, index %d: %s" % (line, column, offset, msg)
+    )
+    assert bool(error.expected) == msg.startswith('unexpected')
+
+    # errors can be sent to other processes
+    copy = pickle.loads(pickle.dumps(error))
+    assert str(copy) == str(error)
+    assert copy.expected == error.expected
+
+
+def test_parser_error_position_ply_lexer():
+    # the ply lexer wrapped by Lexer can be used on its own, and positions
+    # are for its current input after being used for another one
+    from hcl.lexer import Lexer
+
+    parser = hcl.parser.get_parser()
+    for hcl_string, msg, line, column, offset in ERROR_POSITION_FIXTURES:
+        lex = Lexer().lex
+        with pytest.raises(hcl.HclSyntaxError):
+            parser.parse('\n\n\n a = ]', lexer=lex)
+        with pytest.raises(hcl.HclSyntaxError) as e:
+            parser.parse(hcl_string, lexer=lex)
+        error = e.value
+        assert (error.msg, error.line, error.column, error.offset) == (
+            msg, line, column, offset
+        )
+
+
+def test_parser_is_shared():
+    parser = hcl.parser.get_parser()
+    assert hcl.parser.get_parser() is parser
+
+    hcl.parser.reset_parser()
+    assert hcl.parser.get_parser() is not parser
+    assert hcl.loads('a = 1') == {'a': 1}
+
+
+def test_parser_table_cache(tmp_path, monkeypatch):
+    picklefile = str(tmp_path / 'parsetab.dat')
+    monkeypatch.setattr(hcl.parser, 'pickle_file', picklefile)
+
+    hcl.parser.HclParser()
+    assert (tmp_path / 'parsetab.dat').exists()
+
+    # the second parser must come from the cache, not the table generator
+    def fail(*args, **kwargs):
+        raise AssertionError('LALR tables were regenerated')
+
+    with monkeypatch.context() as m:
+        m.setattr(hcl.ply.yacc, 'LRGeneratedTable', fail)
+        parser = hcl.parser.HclParser()
+    assert parser.parse('a = [1, 2]') == {'a': [1, 2]}
+
+
+def test_parser_table_cache_corrupt(tmp_path, monkeypatch):
+    picklefile = tmp_path / 'parsetab.dat'
+    picklefile.write_bytes(b'garbage')
+    monkeypatch.setattr(hcl.parser, 'pickle_file', str(picklefile))
+
+    parser = hcl.parser.HclParser()
+    assert parser.parse('a = "b"') == {'a': 'b'}
+    assert picklefile.read_bytes() != b'garbage'
+
+
+def test_parser_table_module(tmp_path, monkeypatch):
+    from hcl.ply import yacc
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = hcl.parser.get_parser()
+
+    def build():
+        return yacc.yacc(
+            module=module,
+            tabmodule='test_parsetab',
+            write_tables=True,
+            outputdir=str(tmp_path),
+            errorlog=yacc.NullLogger(),
+        )
+
+    build()
+    tabfile = tmp_path / 'test_parsetab.py'
+    assert tabfile.exists()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('LALR tables were regenerated')
+
+    with monkeypatch.context() as m:
+        m.setattr(yacc, 'LRGeneratedTable', fail)
+        build()
+
+        # a table module generated from a different grammar must not be used
+        tabfile.write_text(
+            tabfile.read_text().replace('_lr_signature = ', '_lr_signature = "x" + ')
+        )
+        sys.modules.pop('test_parsetab', None)
+        with pytest.raises(AssertionError):
+            build()
+
+    build()
+    sys.modules.pop('test_parsetab', None)
+
+
+def test_parser_optimize(monkeypatch):
+    from hcl.ply import lex, yacc
+
+    # force the tables and lexer to be generated from scratch
+    monkeypatch.setattr(hcl.parser, 'pickle_file', None)
+    monkeypatch.setattr(hcl.parser, 'tabmodule', None)
+    monkeypatch.setattr(hcl.lexer.Lexer, '_masters', {})
+
+    # full validation of the grammar and lexer rules
+    parser = hcl.parser.HclParser(optimize=False)
+    assert parser.parse('a = {b = "c"}') == {'a': {'b': 'c'}}
+
+    def fail(*args, **kwargs):
+        raise AssertionError('grammar was validated')
+
+    monkeypatch.setattr(yacc.ParserReflect, 'validate_all', fail)
+    monkeypatch.setattr(lex.LexerReflect, 'validate_all', fail)
+
+    parser = hcl.parser.HclParser(optimize=True)
+    assert parser.parse('a = {b = "c"}') == {'a': {'b': 'c'}}
+
+
+def test_parser_large_lists():
+    items = list(range(5000))
+    s = 'a = [%s]\n' % ', '.join(str(i) for i in items)
+    s += 'b {\n%s}\n' % ''.join('k%d = %d\n' % (i, i) for i in items)
+    assert hcl.loads(s) == {'a': items, 'b': dict(('k%d' % i, i) for i in items)}
+
+
+MERGE_FIXTURES = [
+    ('a { b = 1 }\na { b = 2 }', {'a': [{'b': 1}, {'b': 2}]}),
+    ('a { b = 1 }\na { c = 2 }', {'a': {'b': 1, 'c': 2}}),
+    ('a "x" { b = 1 }\na "y" { b = 2 }\na "x" { c = 3 }',
+     {'a': {'x': {'b': 1, 'c': 3}, 'y': {'b': 2}}}),
+    ('a { b = 1 }\na { b = 2 }\na { c = 3 }', {'a': [{'b': 1}, {'b': 2}, {'c': 3}]}),
+    ('x { a { b = 1 }\na { b = 2 }\na = 3 }', {'x': {'a': [{'b': 1}, {'b': 2}, 3]}}),
+    ('a = 1\na = 2', {'a': 2}),
+    ('a = 1\na {}', {'a': 1}),
+]
+
+@pytest.mark.parametrize("hcl_string,expected", MERGE_FIXTURES)
+def test_parser_merge(hcl_string, expected):
+    assert hcl.loads(hcl_string) == expected
+
+
+def test_parser_merge_into_value():
+    with pytest.raises(ValueError):
+        hcl.loads('a = "x"\na { b = 1 }')
+
+
+def test_parser_debug_trace(monkeypatch, capsys):
+    monkeypatch.setattr(hcl.parser, 'DEBUG', True)
+    assert hcl.loads('a = [1]') == {'a': [1]}
+    assert 'p_listitems_0: None | 1' in capsys.readouterr().out
+
+    monkeypatch.setattr(hcl.parser, 'DEBUG', False)
+    assert hcl.loads('a = [1]') == {'a': [1]}
+    assert capsys.readouterr().out == ''
+
+
+VALIDATE_FIXTURES = [
+    ('a = 1\nb {\n  c = "d"\n}\n', []),
+    ('{"a": 1}', []),
+    ('a = = 1\nb = 2\nc = = 3\nd = 4\n', [
+        "Line 1, column 4, index 4: unexpected EQUAL",
+        "Line 3, column 4, index 18: unexpected EQUAL",
+    ]),
+    ('a {\n  b = = 1\n  c = 2\n}\nd = [1, }\ne = 1\nf = = 2\n', [
+        "Line 2, column 6, index 10: unexpected EQUAL",
+        "Line 5, column 8, index 32: unexpected RIGHTBRACE",
+        "Line 7, column 4, index 44: unexpected EQUAL",
+    ]),
+    ('a = 1 } b = 2', [
+        "Line 1, column 6, index 6: unexpected RIGHTBRACE",
+    ]),
+    ('a = "x" ^ b = 1\nc = "d', [
+        "Line 1, column 8, index 8: Illegal character '^'",
+        "Line 2, column 6, index 22: EOF before closing string quote",
+        "Line 2, column 6, index 22: unexpected end of file",
+    ]),
+    ('a {\n', [
+        "Line 2, column 0, index 4: unexpected end of file",
+    ]),
+    ('a = 1\na {\n  b = 1\n}\n', [
+        "Cannot merge block 'a' into a value that isn't an object",
+    ]),
+    ('   ', ["No HCL object could be decoded"]),
+    ('{"a": }', ["Expecting value"]),
+]
+
+
+@pytest.mark.parametrize("hcl_string,expected", VALIDATE_FIXTURES)
+def test_validate(hcl_string, expected):
+    errors = hcl.validate(hcl_string)
+    assert len(errors) == len(expected)
+    for error, message in zip(errors, expected):
+        assert isinstance(error, ValueError)
+        assert str(error).startswith(message)
+
+    # the first error is the one that loads raises
+    if expected:
+        with pytest.raises(ValueError) as e:
+            hcl.loads(hcl_string)
+        assert str(e.value) == str(errors[0])
+    else:
+        hcl.loads(hcl_string)
+
+
+def test_parser_threads():
+    # several threads sharing one parser get the same results as parsing
+    # each document in turn
+    import threading
+
+    inputs = []
+    for hcl_fname, invalid in PARSE_FIXTURES:
+        with open(join(PARSE_FIXTURE_DIR, hcl_fname), 'r') as fp:
+            inputs.append(fp.read())
+    inputs.extend(s for s, _ in VALIDATE_FIXTURES)
+
+    def parse_all():
+        results = []
+        for s in inputs:
+            results.append(hcl.validate(s))
+            try:
+                results.append(hcl.loads(s))
+            except ValueError as e:
+                results.append(str(e))
+        return [str(r) for r in results]
+
+    expected = parse_all()
+
+    # switch threads as often as possible, to interleave the parses
+    if hasattr(sys, 'setswitchinterval'):
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    results = []
+
+    def run():
+        for i in range(5):
+            results.append(parse_all())
+
+    threads = [threading.Thread(target=run) for i in range(4)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        if hasattr(sys, 'setswitchinterval'):
+            sys.setswitchinterval(interval)
+
+    assert len(results) == 20
+    for result in results:
+        assert result == expected